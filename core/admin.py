@@ -10,7 +10,8 @@ from tinymce.widgets import TinyMCE
 from allauth.account.models import EmailAddress
 
 from .models import CustomUser, AplicacionWeb, Alerta, EmailCredentials, ErrorApp, CorreoTemplate, \
-    LlamadoAccion, Modulo, GrupoModulo, AgrupacionModulo, CredencialesAPI, AvisoMasivo, AvisoMasivoLectura
+    LlamadoAccion, Modulo, GrupoModulo, AgrupacionModulo, CredencialesAPI, AvisoMasivo, AvisoMasivoLectura, \
+    AvisoMasivoMarcaLectura, LimpiezaSuscripcionPush, CampanaPush, OutboxMensaje
 
 
 class PremiumFilter(admin.SimpleListFilter):
@@ -242,6 +243,34 @@ class AvisoMasivoLecturaAdmin(admin.ModelAdmin):
     readonly_fields = ('leido_en',)
 
 
+class AvisoMasivoMarcaLecturaAdmin(admin.ModelAdmin):
+    list_display = ('id', 'usuario', 'leido_hasta')
+    search_fields = ('usuario__email', 'usuario__username')
+    raw_id_fields = ('usuario',)
+
+
+class CampanaPushAdmin(admin.ModelAdmin):
+    list_display = (
+        'codigo', 'grupo', 'estado', 'inicio', 'fin', 'total', 'enviadas', 'eliminadas',
+        'fallidas', 'latencia_p50_ms', 'latencia_p95_ms',
+    )
+    list_filter = ('estado',)
+    search_fields = ('codigo', 'grupo')
+    readonly_fields = ('histograma_latencia', 'errores_por_origen')
+
+
+class LimpiezaSuscripcionPushAdmin(admin.ModelAdmin):
+    list_display = ('campana', 'eliminadas', 'creado_en', 'actualizado_en')
+    search_fields = ('campana',)
+    readonly_fields = ('campana', 'eliminadas', 'creado_en', 'actualizado_en')
+
+
+class OutboxMensajeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tarea', 'creado_en', 'enviado_en')
+    list_filter = ('tarea',)
+    readonly_fields = ('tarea', 'args', 'kwargs', 'creado_en', 'enviado_en')
+
+
 class AvisoMasivoAdmin(admin.ModelAdmin):
     list_display = ('id', 'titulo', 'activo', 'publicado_en', 'vigente_hasta')
     list_filter = ('activo',)
@@ -251,4 +280,8 @@ class AvisoMasivoAdmin(admin.ModelAdmin):
 
 
 admin.site.register(AvisoMasivo, AvisoMasivoAdmin)
-admin.site.register(AvisoMasivoLectura, AvisoMasivoLecturaAdmin)
\ No newline at end of file
+admin.site.register(AvisoMasivoLectura, AvisoMasivoLecturaAdmin)
+admin.site.register(AvisoMasivoMarcaLectura, AvisoMasivoMarcaLecturaAdmin)
+admin.site.register(LimpiezaSuscripcionPush, LimpiezaSuscripcionPushAdmin)
+admin.site.register(CampanaPush, CampanaPushAdmin)
+admin.site.register(OutboxMensaje, OutboxMensajeAdmin)
\ No newline at end of file
@@ -1,7 +1,18 @@
-from django.db.models import Q
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, DateTimeField, Exists, OuterRef, Q, Subquery, Value, Window
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
-from .models import AvisoMasivo, AvisoMasivoLectura
+from .models import AvisoMasivo, AvisoMasivoLectura, AvisoMasivoMarcaLectura
+
+_SIN_MARCA = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def usa_marca_lectura():
+    return getattr(settings, 'AVISOS_MASIVOS_MARCA_LECTURA', False)
 
 
 def avisos_masivos_vigentes_qs():
@@ -16,29 +27,101 @@ def avisos_masivos_vigentes_qs():
 
 
 def avisos_masivos_pendientes_para_usuario(user):
+    """
+    Avisos vigentes sin lectura del usuario, como NOT EXISTS correlacionado
+    (la consulta no crece con el historial de lecturas).
+    Con marca de lectura, además solo cuenta lo creado o publicado después de ella.
+    """
     if not user or not user.is_authenticated:
         return AvisoMasivo.objects.none()
     v = avisos_masivos_vigentes_qs()
-    leido_ids = list(
-        AvisoMasivoLectura.objects.filter(usuario=user).values_list(
-            'aviso_id', flat=True
+
+    if usa_marca_lectura():
+        leido_hasta = Coalesce(
+            Subquery(
+                AvisoMasivoMarcaLectura.objects
+                .filter(usuario=user)
+                .values('leido_hasta')[:1]
+            ),
+            Value(_SIN_MARCA, output_field=DateTimeField()),
         )
+        v = v.filter(Q(publicado_en__gt=leido_hasta) | Q(created_at__gt=leido_hasta))
+
+    return v.filter(
+        ~Exists(AvisoMasivoLectura.objects.filter(aviso=OuterRef('pk'), usuario=user))
     )
-    if not leido_ids:
-        return v
-    return v.exclude(id__in=leido_ids)
 
 
 def contar_pendientes_avisos_masivos(user):
     return avisos_masivos_pendientes_para_usuario(user).count()
 
 
+def resumen_avisos_masivos_pendientes(user, limite=5):
+    """
+    Retorna (total_pendientes, primeros `limite` avisos) en una sola consulta:
+    el total viaja en cada fila como COUNT(*) OVER ().
+    """
+    avisos = list(
+        avisos_masivos_pendientes_para_usuario(user)
+        .annotate(total_pendientes=Window(expression=Count('id')))[:limite]
+    )
+    total = avisos[0].total_pendientes if avisos else 0
+    return total, avisos
+
+
+def marcar_marca_lectura(user, leido_hasta=None):
+    """Mueve la marca de lectura del usuario (un UPDATE; INSERT solo la primera vez)."""
+    leido_hasta = leido_hasta or timezone.now()
+    if AvisoMasivoMarcaLectura.objects.filter(usuario=user).update(leido_hasta=leido_hasta):
+        return
+    try:
+        with transaction.atomic():
+            AvisoMasivoMarcaLectura.objects.create(usuario=user, leido_hasta=leido_hasta)
+    except IntegrityError:
+        # Otro request creó la marca en paralelo
+        AvisoMasivoMarcaLectura.objects.filter(usuario=user).update(leido_hasta=leido_hasta)
+
+
 def marcar_todos_avisos_masivos_vistos(user):
     if not user or not user.is_authenticated:
         return 0
-    # get_or_create por fila: fiable en cualquier motor y con concurrencia
-    n = 0
-    for aviso in avisos_masivos_pendientes_para_usuario(user).iterator():
-        AvisoMasivoLectura.objects.get_or_create(aviso=aviso, usuario=user)
-        n += 1
-    return n
+    if usa_marca_lectura():
+        n = contar_pendientes_avisos_masivos(user)
+        marcar_marca_lectura(user)
+        return n
+    return insertar_lecturas_pendientes(user)
+
+
+def insertar_lecturas_pendientes(user):
+    """
+    Registra en bloque la lectura de todos los avisos pendientes del usuario y
+    retorna cuántas filas se insertaron. El unique_together (aviso, usuario)
+    sigue resolviendo la concurrencia: los duplicados se ignoran.
+    """
+    pendientes = avisos_masivos_pendientes_para_usuario(user).order_by().values('id')
+
+    if connection.vendor in ('postgresql', 'sqlite'):
+        # INSERT ... SELECT ... ON CONFLICT DO NOTHING: un solo statement
+        meta = AvisoMasivoLectura._meta
+        qn = connection.ops.quote_name
+        select_sql, select_params = pendientes.query.sql_with_params()
+        sql = (
+            f"INSERT INTO {qn(meta.db_table)} "
+            f"({qn(meta.get_field('aviso').column)}, {qn(meta.get_field('usuario').column)}, "
+            f"{qn(meta.get_field('leido_en').column)}) "
+            f"SELECT pendientes.id, %s, %s FROM ({select_sql}) pendientes WHERE 1 = 1 "
+            f"ON CONFLICT ({qn(meta.get_field('aviso').column)}, {qn(meta.get_field('usuario').column)}) "
+            f"DO NOTHING"
+        )
+        leido_en = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, leido_en, *select_params])
+            return cursor.rowcount
+
+    # Otros motores: bulk_create con ignore_conflicts (conteo aproximado bajo concurrencia)
+    aviso_ids = [fila['id'] for fila in pendientes]
+    AvisoMasivoLectura.objects.bulk_create(
+        [AvisoMasivoLectura(aviso_id=aviso_id, usuario=user) for aviso_id in aviso_ids],
+        ignore_conflicts=True,
+    )
+    return len(aviso_ids)
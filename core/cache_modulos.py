@@ -0,0 +1,172 @@
+"""
+Cache compartido (Django cache / Redis) del menú de módulos y del índice de urls
+permitidas, por conjunto de grupos.
+
+Los usuarios con los mismos grupos comparten una sola entrada. Las claves llevan
+una versión global que se renueva con `invalidar_cache_modulos()` (ver signals.py),
+así no hace falta conocer ni borrar cada combinación de grupos.
+"""
+import re
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+
+from .models import AgrupacionModulo, Modulo, GrupoModulo
+
+CACHE_PREFIX = 'core:modulos'
+VERSION_KEY = f'{CACHE_PREFIX}:version'
+
+# Semántica de coincidencia entre `Modulo.url` y `request.path`
+MATCH_CONTAINS = 'contains'  # la url del módulo aparece en cualquier parte del path (histórico)
+MATCH_PREFIX = 'prefix'      # el path empieza con la url del módulo
+
+
+def _timeout():
+    return getattr(settings, 'MODULOS_CACHE_TIMEOUT', 60 * 60)
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Si la versión se perdió (reinicio/eviction) se crea una nueva:
+        # nunca reutiliza claves antiguas.
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY) or 0
+    return version
+
+
+def _cache_key(*parts):
+    return ':'.join([CACHE_PREFIX, str(_version()), *map(str, parts)])
+
+
+def invalidar_cache_modulos():
+    """Invalida menús y grupos cacheados; se aplica al confirmar la transacción."""
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, time.time_ns(), None))
+
+
+def grupos_usuario_ids(user):
+    """Ids de grupos del usuario, ordenados, cacheados entre requests."""
+    key = _cache_key('user', user.pk)
+    group_ids = cache.get(key)
+    if group_ids is None:
+        group_ids = tuple(sorted(user.groups.values_list('id', flat=True)))
+        cache.set(key, group_ids, _timeout())
+    return group_ids
+
+
+def clave_grupos(user):
+    """'superuser' o los ids de grupos del usuario (p.ej. '3-5-8')."""
+    if user.is_superuser:
+        return 'superuser'
+    return '-'.join(map(str, grupos_usuario_ids(user))) or 'sin-grupos'
+
+
+def _construir_menu(group_ids=None):
+    """
+    Construye el árbol agrupaciones → módulos. `group_ids=None` equivale a superusuario.
+    Cada agrupación queda con `modulos_permitidos` (lista) para poder serializarse.
+    """
+    modulos_qs = Modulo.objects.filter(activo=True)
+    agrupaciones = AgrupacionModulo.objects.all()
+
+    if group_ids is None:
+        modulos_ids = set(Modulo.objects.values_list('id', flat=True))
+    else:
+        modulos_qs = modulos_qs.filter(grupomodulo__grupo__in=group_ids).distinct()
+        agrupaciones = agrupaciones.filter(modulos__grupomodulo__grupo__in=group_ids).distinct()
+        modulos_ids = set(
+            Modulo.objects
+            .filter(grupomodulo__grupo__in=group_ids, activo=True)
+            .distinct()
+            .values_list('id', flat=True)
+        )
+
+    agrupaciones = (
+        agrupaciones
+        .prefetch_related(
+            models.Prefetch(
+                'modulos',
+                queryset=modulos_qs.order_by('orden'),
+                to_attr='modulos_permitidos'
+            )
+        )
+        .order_by('orden', 'nombre')
+    )
+
+    return {
+        'agrupaciones': [a for a in agrupaciones if a.modulos_permitidos],
+        'modulos_ids': modulos_ids,
+    }
+
+
+def menu_modulos_usuario(user):
+    """
+    Retorna {'agrupaciones': [...], 'modulos_ids': set()} para `user`
+    desde el cache compartido; solo consulta la BD al reconstruir la entrada.
+    """
+    clave = clave_grupos(user)
+    key = _cache_key('menu', clave)
+    menu = cache.get(key)
+    if menu is None:
+        group_ids = None if user.is_superuser else grupos_usuario_ids(user)
+        menu = _construir_menu(group_ids)
+        cache.set(key, menu, _timeout())
+    return menu
+
+
+def urls_modulos_grupos(group_ids):
+    """
+    (prefijos, urls) de los módulos de los grupos, cacheados por conjunto de grupos.
+    `prefijos` son los `AgrupacionModulo.prefijo_url` bajo los que se montan los módulos.
+    """
+    key = _cache_key('urls', '-'.join(map(str, group_ids)) or 'sin-grupos')
+    datos = cache.get(key)
+    if datos is None:
+        urls = tuple(sorted({
+            url for url in GrupoModulo.objects
+            .filter(grupo_id__in=group_ids)
+            .values_list('modulos__url', flat=True)
+            if url
+        }))
+        prefijos = tuple(sorted({
+            prefijo.strip('/') for prefijo in AgrupacionModulo.objects
+            .values_list('prefijo_url', flat=True)
+            .distinct()
+            if prefijo and prefijo.strip('/')
+        }))
+        datos = (prefijos, urls)
+        cache.set(key, datos, _timeout())
+    return datos
+
+
+@lru_cache(maxsize=256)
+def _compilar_urls(prefijos, urls, modo):
+    """Una sola expresión regular por (prefijos, urls, modo); se compila una vez por proceso."""
+    if modo not in (MATCH_CONTAINS, MATCH_PREFIX):
+        raise ValueError(f"Modo de coincidencia de módulos no válido: {modo!r}")
+    if not urls:
+        return None
+    if modo == MATCH_CONTAINS:
+        return re.compile('|'.join(map(re.escape, urls)))
+    # Prefijo: '/<prefijo_url>/<url>' o '/<url>' anclado al inicio del path
+    alternativas = '|'.join(sorted({re.escape(url.lstrip('/')) for url in urls}))
+    montajes = '|'.join(re.escape(prefijo) + '/' for prefijo in prefijos)
+    return re.compile(f'/(?:{montajes})?(?:{alternativas})' if montajes else f'/(?:{alternativas})')
+
+
+def path_permitido(user, path, modo=None):
+    """
+    True si `path` coincide con la url de algún módulo de los grupos de `user`.
+    `modo` es MATCH_CONTAINS o MATCH_PREFIX (por defecto `settings.MODULOS_URL_MATCH`).
+    """
+    modo = modo or getattr(settings, 'MODULOS_URL_MATCH', MATCH_CONTAINS)
+    prefijos, urls = urls_modulos_grupos(grupos_usuario_ids(user))
+    patron = _compilar_urls(prefijos, urls, modo)
+    if patron is None:
+        return False
+    if modo == MATCH_PREFIX:
+        return patron.match(path) is not None
+    return patron.search(path) is not None
@@ -0,0 +1,109 @@
+"""
+Cache de configuración del sitio: `AplicacionWeb` (singleton) y alertas activas.
+
+Dos niveles: un LRU local por proceso delante del cache compartido (Redis).
+Las claves llevan una versión global que se renueva en `invalidar_cache_sitio()`
+(signals post_save/post_delete); cada proceso relee esa versión como máximo cada
+`SITIO_CACHE_LOCAL_TTL` segundos, así todos los workers convergen sin consultar la BD.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import AplicacionWeb, Alerta
+
+CACHE_PREFIX = 'core:sitio'
+VERSION_KEY = f'{CACHE_PREFIX}:version'
+
+
+class _LocalLRU:
+    """LRU pequeño y thread-safe para objetos de solo lectura."""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = None
+        self.version_leida_en = 0.0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.version = None
+            self.version_leida_en = 0.0
+
+
+_local = _LocalLRU()
+_VACIO = object()
+
+
+def _timeout():
+    return getattr(settings, 'SITIO_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _version():
+    ttl_local = getattr(settings, 'SITIO_CACHE_LOCAL_TTL', 5)
+    ahora = time.monotonic()
+    if _local.version is not None and ahora - _local.version_leida_en < ttl_local:
+        return _local.version
+
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY) or 0
+    _local.version, _local.version_leida_en = version, ahora
+    return version
+
+
+def _obtener(nombre, cargar):
+    version = _version()
+    local_key = (nombre, version)
+    valor = _local.get(local_key, _VACIO)
+    if valor is not _VACIO:
+        return valor
+
+    key = f'{CACHE_PREFIX}:{version}:{nombre}'
+    envuelto = cache.get(key)
+    if envuelto is None:
+        # Se guarda en una tupla para poder cachear también `None`
+        envuelto = (cargar(),)
+        cache.set(key, envuelto, _timeout())
+    valor = envuelto[0]
+    _local.set(local_key, valor)
+    return valor
+
+
+def get_aplicacion_web():
+    """`AplicacionWeb.objects.first()` cacheado. Tratar como solo lectura."""
+    return _obtener('aplicacion_web', AplicacionWeb.objects.first)
+
+
+def get_alertas_activas():
+    """Lista de alertas activas cacheada. Tratar como solo lectura."""
+    return _obtener('alertas', lambda: list(Alerta.objects.filter(activo=True)))
+
+
+def invalidar_cache_sitio():
+    """Renueva la versión al confirmar la transacción; el proceso actual lo ve de inmediato."""
+    def _invalidar():
+        cache.set(VERSION_KEY, time.time_ns(), None)
+        _local.clear()
+    transaction.on_commit(_invalidar)
@@ -0,0 +1,155 @@
+"""
+Métricas persistentes de campañas Web Push (`CampanaPush`).
+
+Cada despachador acumula en memoria contadores, errores por origen y un histograma
+de latencias, y los vuelca a la fila de la campaña cada `WEBPUSH_CAMPAIGN_FLUSH_EVERY`
+resultados o `WEBPUSH_CAMPAIGN_FLUSH_SECONDS` segundos. Los tramos corren en
+paralelo, así que el volcado se hace con la fila bloqueada (SELECT ... FOR UPDATE).
+p50/p95 se calculan sobre el histograma, con la precisión de sus límites.
+"""
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CampanaPush
+
+# Límites superiores (ms) de los buckets del histograma de latencia
+LATENCIA_BUCKETS_MS = (5, 10, 20, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000, 30000)
+ERRORES = ("throttled", "transient", "failed")
+
+
+def _bucket(latencia_ms):
+    for limite in LATENCIA_BUCKETS_MS:
+        if latencia_ms <= limite:
+            return str(limite)
+    return "inf"
+
+
+def percentil(histograma, q):
+    """Límite del bucket donde la frecuencia acumulada alcanza `q` (0-1); None sin datos."""
+    total = sum(histograma.values())
+    if not total:
+        return None
+    acumulado = 0
+    for limite in sorted(histograma, key=lambda b: float(b)):
+        acumulado += histograma[limite]
+        if acumulado >= q * total:
+            # "inf": se reporta el último límite finito
+            return float(limite) if limite != "inf" else float(LATENCIA_BUCKETS_MS[-1])
+    return None
+
+
+def registrar_campana(codigo, grupo, payload):
+    """Crea (o retorna) la campaña `codigo` en estado pendiente."""
+    campana, _ = CampanaPush.objects.get_or_create(
+        codigo=codigo, defaults={"grupo": grupo, "payload": payload}
+    )
+    return campana
+
+
+def iniciar_campana(codigo, grupo, payload, total):
+    """Marca la campaña como enviando (el inicio solo se fija la primera vez)."""
+    campana = registrar_campana(codigo, grupo, payload)
+    CampanaPush.objects.filter(pk=campana.pk, inicio__isnull=True).update(
+        inicio=timezone.now(), estado=CampanaPush.ESTADO_ENVIANDO
+    )
+    CampanaPush.objects.filter(pk=campana.pk).update(total=total)
+
+
+def finalizar_campana(codigo):
+    CampanaPush.objects.filter(codigo=codigo).update(
+        fin=timezone.now(), estado=CampanaPush.ESTADO_FINALIZADA
+    )
+
+
+def progreso_campana(campana):
+    """Dict serializable con el avance y las métricas de `campana`."""
+    procesadas = campana.enviadas + campana.eliminadas + campana.fallidas
+    fin = campana.fin or timezone.now()
+    duracion = (fin - campana.inicio).total_seconds() if campana.inicio else 0
+    return {
+        "codigo": campana.codigo,
+        "grupo": campana.grupo,
+        "head": campana.payload.get("head", ""),
+        "estado": campana.estado,
+        "inicio": campana.inicio.isoformat() if campana.inicio else None,
+        "fin": campana.fin.isoformat() if campana.fin else None,
+        "total": campana.total,
+        "procesadas": procesadas,
+        "enviadas": campana.enviadas,
+        "eliminadas": campana.eliminadas,
+        "fallidas": campana.fallidas,
+        "reprogramadas": campana.reprogramadas,
+        "porcentaje": round(procesadas * 100 / campana.total, 2) if campana.total else 0,
+        "duracion_s": round(duracion, 2),
+        "por_segundo": round(procesadas / duracion, 2) if duracion else 0,
+        "latencia_p50_ms": campana.latencia_p50_ms,
+        "latencia_p95_ms": campana.latencia_p95_ms,
+        "errores_por_origen": campana.errores_por_origen,
+    }
+
+
+class MetricasCampana:
+    """Acumulador de métricas de un despachador; se usa desde un solo hilo."""
+
+    def __init__(self, codigo):
+        self.codigo = codigo
+        self.flush_every = getattr(settings, "WEBPUSH_CAMPAIGN_FLUSH_EVERY", 200)
+        self.flush_seconds = getattr(settings, "WEBPUSH_CAMPAIGN_FLUSH_SECONDS", 5)
+        self._reset()
+
+    def _reset(self):
+        self.contadores = {"enviadas": 0, "eliminadas": 0, "fallidas": 0, "reprogramadas": 0}
+        self.histograma = {}
+        self.errores = {}
+        self.pendientes = 0
+        self.ultimo_flush = time.monotonic()
+
+    def intento(self, origin, status, latencia_ms):
+        """Cada respuesta de un servicio push, incluidos los intentos que se reintentan."""
+        bucket = _bucket(latencia_ms)
+        self.histograma[bucket] = self.histograma.get(bucket, 0) + 1
+        if status in ERRORES:
+            por_origen = self.errores.setdefault(origin or "?", {})
+            por_origen[status] = por_origen.get(status, 0) + 1
+
+    def resultado(self, status):
+        """Resultado final de un destinatario: sent, deleted o failed."""
+        campo = {"sent": "enviadas", "deleted": "eliminadas"}.get(status, "fallidas")
+        self.contadores[campo] += 1
+        self.pendientes += 1
+        if (
+            self.pendientes >= self.flush_every
+            or time.monotonic() - self.ultimo_flush >= self.flush_seconds
+        ):
+            self.flush()
+
+    def reprogramadas(self, cantidad):
+        self.contadores["reprogramadas"] += cantidad
+
+    def flush(self):
+        if not self.pendientes and not self.histograma and not self.contadores["reprogramadas"]:
+            return
+        contadores, histograma, errores = self.contadores, self.histograma, self.errores
+        self._reset()
+
+        with transaction.atomic():
+            campana = CampanaPush.objects.select_for_update().filter(codigo=self.codigo).first()
+            if campana is None:
+                return
+            for bucket, cantidad in histograma.items():
+                campana.histograma_latencia[bucket] = campana.histograma_latencia.get(bucket, 0) + cantidad
+            for origin, por_estado in errores.items():
+                actual = campana.errores_por_origen.setdefault(origin, {})
+                for status, cantidad in por_estado.items():
+                    actual[status] = actual.get(status, 0) + cantidad
+            for campo, cantidad in contadores.items():
+                setattr(campana, campo, getattr(campana, campo) + cantidad)
+            campana.latencia_p50_ms = percentil(campana.histograma_latencia, 0.5)
+            campana.latencia_p95_ms = percentil(campana.histograma_latencia, 0.95)
+            campana.save(update_fields=[
+                *contadores, "histograma_latencia", "errores_por_origen",
+                "latencia_p50_ms", "latencia_p95_ms", "modified_by", "modified_at",
+            ])
@@ -0,0 +1,221 @@
+"""
+Contador de notificaciones no leídas por usuario (badge de la campana).
+
+Con `settings.NOTIFICACIONES_CONTADOR_REDIS_URL` el contador vive en Redis:
+INCRBY/SET atómicos sobre el valor del badge y, aparte, sobre lo sumado desde el último
+volcado (`delta:<usuario>`), más un set de usuarios "sucios". `sincronizar_contadores()`
+suma esos deltas a NotificacionUsuarioCount (programar
+`sincronizar_contadores_notificaciones_task` en Celery beat, p.ej. cada minuto); no
+sobrescribe el valor de la BD. `resetear_contador()` escribe 0 en Redis y en la BD.
+
+Sin Redis, o si Redis falla, se usa la BD con UPDATE ... SET numero = numero + n. Los
+usuarios incrementados así quedan marcados en el proceso y, cuando Redis responde otra
+vez, se borra su valor en Redis para recargarlo desde la BD (más el delta pendiente).
+"""
+import logging
+import threading
+from collections import defaultdict
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import NotificacionUsuarioCount
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'core:noti_count'
+DIRTY_KEY = f'{KEY_PREFIX}:pendientes_sync'
+KEY_TTL = 60 * 60 * 24 * 7
+
+_redis_client = None
+
+# Usuarios con incrementos hechos en la BD mientras Redis no respondía
+_obsoletos = set()
+_obsoletos_lock = threading.Lock()
+
+
+def _key(usuario_id):
+    return f'{KEY_PREFIX}:{usuario_id}'
+
+
+def _delta_key(usuario_id):
+    return f'{KEY_PREFIX}:delta:{usuario_id}'
+
+
+def _get_redis():
+    """Cliente Redis compartido, o None si no está configurado."""
+    global _redis_client
+    url = getattr(settings, 'NOTIFICACIONES_CONTADOR_REDIS_URL', None)
+    if not url:
+        return None
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+    return _redis_client
+
+
+def _valores_bd(usuario_ids):
+    return dict(
+        NotificacionUsuarioCount.objects
+        .filter(usuario_id__in=usuario_ids)
+        .values_list('usuario_id', 'numero')
+    )
+
+
+def _marcar_obsoletos(usuario_ids):
+    with _obsoletos_lock:
+        _obsoletos.update(usuario_ids)
+
+
+def _limpiar_obsoletos(client):
+    """Borra de Redis el valor de los usuarios incrementados en la BD durante una caída."""
+    with _obsoletos_lock:
+        usuario_ids = list(_obsoletos)
+        _obsoletos.clear()
+    if not usuario_ids:
+        return
+    try:
+        client.delete(*[_key(uid) for uid in usuario_ids])
+    except Exception:
+        _marcar_obsoletos(usuario_ids)
+        raise
+
+
+def _inicializar_redis(client, usuario_ids):
+    """
+    Carga desde la BD (+ el delta aún no volcado) los contadores que no existen en Redis
+    (SET NX: sin carreras).
+    """
+    existentes = client.mget([_key(uid) for uid in usuario_ids])
+    faltantes = [uid for uid, valor in zip(usuario_ids, existentes) if valor is None]
+    if not faltantes:
+        return
+    valores = _valores_bd(faltantes)
+    deltas = client.mget([_delta_key(uid) for uid in faltantes])
+    pipe = client.pipeline()
+    for uid, delta in zip(faltantes, deltas):
+        pipe.set(_key(uid), valores.get(uid, 0) + int(delta or 0), nx=True, ex=KEY_TTL)
+    pipe.execute()
+
+
+def _incrementar_bd(usuario_ids, cantidad):
+    # Asegura las filas (los duplicados se ignoran) y luego un UPDATE atómico
+    NotificacionUsuarioCount.objects.bulk_create(
+        [NotificacionUsuarioCount(usuario_id=uid, numero=0) for uid in usuario_ids],
+        ignore_conflicts=True,
+    )
+    NotificacionUsuarioCount.objects.filter(usuario_id__in=usuario_ids).update(
+        numero=F('numero') + cantidad
+    )
+
+
+def incrementar_contadores(usuario_ids, cantidad=1):
+    """Suma `cantidad` al contador de cada usuario de `usuario_ids`."""
+    usuario_ids = list(dict.fromkeys(usuario_ids))
+    if not usuario_ids:
+        return
+
+    client = _get_redis()
+    if client is not None:
+        try:
+            _limpiar_obsoletos(client)
+            _inicializar_redis(client, usuario_ids)
+            pipe = client.pipeline()
+            for uid in usuario_ids:
+                pipe.incrby(_key(uid), cantidad)
+                pipe.expire(_key(uid), KEY_TTL)
+                pipe.incrby(_delta_key(uid), cantidad)
+            pipe.sadd(DIRTY_KEY, *usuario_ids)
+            pipe.execute()
+            return
+        except Exception:
+            logger.exception("Contador de notificaciones: Redis no disponible, usando la BD")
+        _marcar_obsoletos(usuario_ids)
+
+    _incrementar_bd(usuario_ids, cantidad)
+
+
+def obtener_contador(usuario_id):
+    """Valor actual del badge del usuario."""
+    client = _get_redis()
+    if client is not None:
+        try:
+            _limpiar_obsoletos(client)
+            valor = client.get(_key(usuario_id))
+            if valor is None:
+                _inicializar_redis(client, [usuario_id])
+                valor = client.get(_key(usuario_id))
+            return int(valor or 0)
+        except Exception:
+            logger.exception("Contador de notificaciones: Redis no disponible, usando la BD")
+
+    return _valores_bd([usuario_id]).get(usuario_id, 0)
+
+
+def resetear_contador(usuario_id):
+    """Pone el contador en 0 (Redis y BD)."""
+    client = _get_redis()
+    if client is not None:
+        try:
+            _limpiar_obsoletos(client)
+            pipe = client.pipeline()
+            pipe.set(_key(usuario_id), 0, ex=KEY_TTL)
+            pipe.delete(_delta_key(usuario_id))
+            pipe.execute()
+        except Exception:
+            logger.exception("Contador de notificaciones: Redis no disponible, usando la BD")
+            _marcar_obsoletos([usuario_id])
+
+    # Sin fila el contador ya es 0: basta un UPDATE
+    NotificacionUsuarioCount.objects.filter(usuario_id=usuario_id).update(numero=0)
+
+
+def sincronizar_contadores(lote=1000):
+    """
+    Suma a NotificacionUsuarioCount los deltas acumulados en Redis (no sobrescribe lo que
+    se incrementó directamente en la BD). Retorna a cuántos usuarios se les sumó algo.
+    """
+    client = _get_redis()
+    if client is None:
+        return 0
+
+    total = 0
+    while True:
+        usuario_ids = [int(uid) for uid in client.spop(DIRTY_KEY, lote) or []]
+        if not usuario_ids:
+            return total
+        # MULTI/EXEC: lectura y borrado de cada delta sin perder incrementos concurrentes
+        pipe = client.pipeline()
+        for uid in usuario_ids:
+            pipe.get(_delta_key(uid))
+            pipe.delete(_delta_key(uid))
+        resultados = pipe.execute()
+        deltas = {
+            uid: int(delta)
+            for uid, delta in zip(usuario_ids, resultados[::2])
+            if delta is not None and int(delta)
+        }
+        por_cantidad = defaultdict(list)
+        for uid, delta in deltas.items():
+            por_cantidad[delta].append(uid)
+        try:
+            with transaction.atomic():
+                for cantidad, ids in por_cantidad.items():
+                    _incrementar_bd(ids, cantidad)
+        except Exception:
+            # Se devuelven los deltas para el próximo ciclo
+            pipe = client.pipeline()
+            for uid, delta in deltas.items():
+                pipe.incrby(_delta_key(uid), delta)
+            pipe.sadd(DIRTY_KEY, *usuario_ids)
+            pipe.execute()
+            raise
+        total += len(deltas)
+
+
+@shared_task
+def sincronizar_contadores_notificaciones_task():
+    """Tarea periódica (Celery beat) de volcado Redis → BD."""
+    return sincronizar_contadores()
@@ -1,33 +1,61 @@
-from .models import Alerta
-from .models import AplicacionWeb, Alerta
-from .models import NotificacionUsuario, NotificacionUsuarioCount
 from django.conf import settings
+from django.utils.functional import cached_property, lazy
 
-from .avisos_masivos import avisos_masivos_pendientes_para_usuario, contar_pendientes_avisos_masivos
+from .models import NotificacionUsuario
+from .cache_sitio import get_aplicacion_web, get_alertas_activas
+from .avisos_masivos import resumen_avisos_masivos_pendientes
+from .contador_notificaciones import obtener_contador
+
+
+class NotificacionesUsuarioContexto:
+    """
+    Datos de la campana de notificaciones, cargados solo cuando una plantilla
+    los usa. El total y la vista previa de avisos masivos salen de una consulta.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def notificaciones(self):
+        # QuerySet sin evaluar: solo consulta si la plantilla lo recorre
+        return (
+            NotificacionUsuario.objects
+            .filter(usuario_notificado=self.user)
+            .select_related('tipo', 'usuario_notifica')
+            .order_by('-id')[:5]
+        )
+
+    @cached_property
+    def num_individuales(self):
+        return obtener_contador(self.user.pk)
+
+    @cached_property
+    def _avisos_masivos(self):
+        return resumen_avisos_masivos_pendientes(self.user, limite=5)
+
+    def num_avisos_masivos(self):
+        return self._avisos_masivos[0]
+
+    def avisos_masivos_pendientes(self):
+        return self._avisos_masivos[1]
+
+    def num_badge(self):
+        return self.num_individuales + self.num_avisos_masivos()
 
 
 def main_context(request):
     context = {}
-    context['alertas'] = Alerta.objects.filter(activo=True)
-    context['application'] = AplicacionWeb.objects.first()
+    context['alertas'] = get_alertas_activas()
+    context['application'] = get_aplicacion_web()
 
     if settings.WEBPUSH_HABILITADO:
         context['webpush_habilitado'] = True
 
     if request.user.is_authenticated:
-        notificaciones = NotificacionUsuario.objects.filter(
-            usuario_notificado=request.user
-        ).order_by('-id')[:5]
-        noti_count = NotificacionUsuarioCount.objects.filter(
-            usuario=request.user
-        ).first()
-        num_individuales = noti_count.numero if noti_count else 0
-        num_masivos = contar_pendientes_avisos_masivos(request.user)
-        context['num_notificaciones'] = num_individuales
-        context['num_avisos_masivos_pendientes'] = num_masivos
-        context['num_notificaciones_badge'] = num_individuales + num_masivos
-        context['notificaciones'] = notificaciones
-        context['avisos_masivos_pendientes'] = list(
-            avisos_masivos_pendientes_para_usuario(request.user)[:5]
-        )
+        datos = NotificacionesUsuarioContexto(request.user)
+        context['num_notificaciones'] = lazy(lambda: datos.num_individuales, int)()
+        context['num_avisos_masivos_pendientes'] = lazy(datos.num_avisos_masivos, int)()
+        context['num_notificaciones_badge'] = lazy(datos.num_badge, int)()
+        context['notificaciones'] = datos.notificaciones()
+        context['avisos_masivos_pendientes'] = lazy(datos.avisos_masivos_pendientes, list)()
     return context
@@ -1,9 +1,13 @@
+import warnings
 from threading import Thread
 
+from celery import shared_task
 from django.core.mail import EmailMessage
 from django.db import transaction
 
-from .models import EmailCredentials, AplicacionWeb
+from .models import EmailCredentials
+from .cache_sitio import get_aplicacion_web
+from .outbox import registrar
 from django.core.mail.backends.smtp import EmailBackend
 
 def get_next_email():
@@ -45,7 +49,7 @@ def send_email(subject, body, to):
         else:
             to_final = [to]
 
-        application = AplicacionWeb.objects.first()
+        application = get_aplicacion_web()
         titulo = application.titulo_sitio
 
         email = EmailMessage(
@@ -64,13 +68,60 @@ def send_email(subject, body, to):
         print(f"Error al enviar el correo: {ex}")
 
 
+def send_emails(subject, body, destinatarios):
+    """
+    Envía el mismo correo a cada destinatario por separado (nadie ve las demás
+    direcciones) con una sola conexión SMTP y una sola cuenta de `EmailCredentials`.
+    """
+    destinatarios = [d for d in dict.fromkeys(destinatarios) if d]
+    if not destinatarios:
+        return
+    email_credentials = get_next_email()
+    if email_credentials is None:
+        print("No hay cuentas de correo disponibles")
+        return
+    try:
+        backend = EmailBackend(
+            host=email_credentials.host,
+            port=email_credentials.port,
+            username=email_credentials.username,
+            password=email_credentials.password,
+            use_tls=email_credentials.use_tls,
+            use_ssl=email_credentials.use_ssl
+        )
+        application = get_aplicacion_web()
+        remitente = f'{application.titulo_sitio} <{email_credentials.username}>'
+
+        mensajes = []
+        for destinatario in destinatarios:
+            email = EmailMessage(subject, body, remitente, [destinatario], connection=backend)
+            email.content_subtype = "html"
+            mensajes.append(email)
+        enviados = backend.send_messages(mensajes) or 0
+        email_credentials.conteo += enviados
+        email_credentials.save()
+
+    except Exception as ex:
+        print(f"Error al enviar los correos: {ex}")
+
+
 class GroupEmailThread(Thread):
+    """
+    Obsoleto: usar `send_email_thread`, que pasa por el outbox (no envía si la
+    transacción se revierte). Se mantiene por compatibilidad.
+    """
+
     def __init__(self, subject, body, to):
+        warnings.warn(
+            "GroupEmailThread está obsoleto; usar send_email_thread",
+            DeprecationWarning,
+            stacklevel=2,
+        )
         self.subject = subject
         self.body = body
         self.to = to
         Thread.__init__(self)
-        
+
     def run(self):
         try:
             send_email(self.subject, self.body, self.to)
@@ -78,15 +129,36 @@ class GroupEmailThread(Thread):
             print(ex)
             pass
 
+@shared_task
+def send_email_task(subject, body, to):
+    send_email(subject, body, to)
+
+
+@shared_task
+def send_emails_task(subject, body, destinatarios):
+    send_emails(subject, body, destinatarios)
+
+
 # ************************************************************************************************
 # Funciones
 # ************************************************************************************************
 def send_email_thread(subject, body, to):
     """
-    Envía un correo electrónico en un hilo.
+    Envía un correo electrónico en segundo plano, después del commit de la transacción
+    actual (outbox, ver core/outbox.py); si la transacción se revierte no se envía.
     :param subject: El asunto del correo.
     :param body: El cuerpo del correo.
     :param to: El destinatario del correo
     """
-    GroupEmailThread(subject, body, to).start()
+    registrar(send_email_task, subject, body, to)
     return
+
+
+def send_emails_thread(subject, body, destinatarios):
+    """
+    Como `send_email_thread` pero para una lista de destinatarios: un solo mensaje en
+    el outbox y un correo individual por destinatario.
+    """
+    destinatarios = [d for d in dict.fromkeys(destinatarios) if d]
+    if destinatarios:
+        registrar(send_emails_task, subject, body, destinatarios)
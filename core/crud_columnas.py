@@ -0,0 +1,143 @@
+"""
+Accesores precompilados para las celdas de `ModelCRUDView.build_table_rows`.
+
+Cada columna de `list_display` se compila una sola vez por (modelo, path) en una
+función especializada según el tipo de campo que indica `_meta` (fecha, fecha-hora,
+booleano, decimal, texto/ícono, relación, M2M). Renderizar una página queda en lecturas
+directas de atributos, sin volver a partir el path ni intentar `parse_datetime` /
+`parse_date` en cada celda.
+
+Los callables y los paths que terminan en métodos o properties no tienen un tipo
+conocido: siguen el camino genérico (`resolve_attr` + `formatear_valor`).
+"""
+import datetime
+from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .utils import looks_like_icon_class, resolve_attr
+
+FORMATO_FECHA = "%d/%m/%Y"
+FORMATO_FECHA_HORA = "%d/%m/%Y %H:%M"
+
+_TEXTO = {"CharField", "TextField", "SlugField", "EmailField", "URLField"}
+_NUMERO = {
+    "AutoField", "BigAutoField", "SmallAutoField", "IntegerField", "BigIntegerField",
+    "SmallIntegerField", "PositiveIntegerField", "PositiveBigIntegerField",
+    "PositiveSmallIntegerField", "FloatField", "UUIDField",
+}
+
+
+def _fecha_hora(value):
+    if settings.USE_TZ:
+        try:
+            value = timezone.localtime(value)
+        except Exception:
+            # p.ej. datetime naive: se usa el valor original
+            pass
+    return value.strftime(FORMATO_FECHA_HORA)
+
+
+def formatear_valor(value):
+    """Formato de celda para valores de tipo desconocido (callables, properties)."""
+    try:
+        if isinstance(value, datetime.datetime):
+            return _fecha_hora(value)
+        if isinstance(value, datetime.date):
+            return value.strftime(FORMATO_FECHA)
+        if isinstance(value, str):
+            parsed_datetime = parse_datetime(value)
+            if parsed_datetime is not None:
+                return _fecha_hora(parsed_datetime)
+            parsed_date = parse_date(value)
+            if parsed_date is not None:
+                return parsed_date.strftime(FORMATO_FECHA)
+    except Exception:
+        # Si cualquier cosa falla al formatear, caeremos al str(value)
+        pass
+    return str(value)
+
+
+def _lector(parts):
+    """Función que recorre `parts` con getattr; None si algún tramo es None."""
+    if len(parts) == 1:
+        name = parts[0]
+        return lambda o: getattr(o, name, None)
+
+    def leer(o):
+        for part in parts:
+            o = getattr(o, part, None)
+            if o is None:
+                return None
+        return o
+    return leer
+
+
+def _formateador(field):
+    """Formato específico para el tipo de `field`, o None si no se conoce."""
+    if field.many_to_many or field.one_to_many:
+        return lambda v: ", ".join(map(str, v.all()))
+    if field.is_relation:
+        return str
+    tipo = field.get_internal_type()
+    if tipo == "DateTimeField":
+        return _fecha_hora
+    if tipo == "DateField":
+        return lambda v: v.strftime(FORMATO_FECHA)
+    if tipo in ("BooleanField", "NullBooleanField"):
+        return lambda v: "✅" if v else "❌"
+    if tipo == "DecimalField":
+        return lambda v: format(v, "f") if isinstance(v, Decimal) else str(v)
+    if tipo in _TEXTO:
+        # El tipo de campo no distingue un ícono de un texto: solo se mira el prefijo
+        return lambda v: f'<i class="{v}"></i>' if looks_like_icon_class(v) else v
+    if tipo in _NUMERO:
+        return str
+    return None
+
+
+def _campo_final(model, parts):
+    """Campo de `_meta` al final de `parts` (solo a través de FK/O2O), o None."""
+    field = None
+    for i, part in enumerate(parts):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        if i < len(parts) - 1:
+            if not field.is_relation or field.many_to_many or field.one_to_many or field.related_model is None:
+                return None
+            model = field.related_model
+    return field
+
+
+@lru_cache(maxsize=None)
+def _compilar_path(model, path):
+    parts = tuple(path.split("__"))
+    field = _campo_final(model, parts)
+    formato = _formateador(field) if field is not None else None
+    if formato is None:
+        return lambda o: formatear_valor(resolve_attr(o, path))
+
+    leer = _lector(parts)
+
+    def accesor(o):
+        value = leer(o)
+        if value is None:
+            return ""
+        try:
+            return formato(value)
+        except Exception:
+            return str(value)
+    return accesor
+
+
+def compilar_columna(model, spec):
+    """Función obj -> texto de la celda para `spec` (path de `list_display` o callable)."""
+    if callable(spec):
+        return lambda o: formatear_valor(spec(o))
+    return _compilar_path(model, spec)
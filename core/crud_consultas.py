@@ -0,0 +1,109 @@
+"""
+Planificación de consultas para `ModelCRUDView`.
+
+A partir de los paths estilo ORM de `list_display` / `export_fields`
+('relacion__subrelacion__campo') se deducen los `select_related` (cadenas FK/O2O) y
+los `prefetch_related` (M2M y relaciones inversas) que evitan una consulta por celda.
+El análisis usa solo `_meta` y se cachea por (modelo, paths), así que se hace una vez
+por vista y no en cada request.
+
+`cruza_multivaluada` indica si un lookup de búsqueda o filtro atraviesa una relación
+M2M / inversa; esos filtros se aplican con `Exists()` para no duplicar filas y así el
+listado no necesita `DISTINCT`.
+"""
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+
+SEP = "__"
+
+
+def _relaciones_del_path(model, path):
+    """
+    Recorre `path` sobre `_meta` y retorna (cadena_simple, multivaluada):
+    - cadena_simple: partes relacionales de un solo valor (FK/O2O) desde el inicio.
+    - multivaluada: la primera relación M2M / inversa (o GenericForeignKey) o None.
+    Se detiene en el primer campo no relacional, método o property.
+    """
+    cadena = []
+    for parte in path.split(SEP):
+        try:
+            field = model._meta.get_field(parte)
+        except FieldDoesNotExist:
+            break
+        if not field.is_relation:
+            break
+        if field.related_model is None or field.many_to_many or field.one_to_many:
+            # `resolve_attr` no atraviesa managers: no hace falta seguir
+            return cadena, parte
+        cadena.append(parte)
+        model = field.related_model
+    return cadena, None
+
+
+@lru_cache(maxsize=None)
+def plan_relaciones(model, paths):
+    """
+    (select_related, prefetch_related) para los `paths` (tupla de str) de `model`.
+    Solo incluye las cadenas más largas: 'a__b' ya cubre 'a'.
+    """
+    select, prefetch = [], []
+    for path in paths:
+        cadena, multivaluada = _relaciones_del_path(model, path)
+        if multivaluada is not None:
+            prefetch.append(SEP.join(cadena + [multivaluada]))
+        if cadena:
+            select.append(SEP.join(cadena))
+
+    def _maximales(lookups):
+        unicos = sorted(set(lookups))
+        return [
+            lookup for lookup in unicos
+            if not any(otro.startswith(lookup + SEP) for otro in unicos)
+        ]
+
+    return _maximales(select), _maximales(prefetch)
+
+
+@lru_cache(maxsize=None)
+def cruza_multivaluada(model, lookup):
+    """
+    True si el lookup ('relacion__campo__icontains') atraviesa una relación M2M o
+    inversa: un JOIN por ese path puede repetir filas del modelo principal.
+    """
+    for parte in lookup.split(SEP):
+        try:
+            field = model._meta.get_field(parte)
+        except FieldDoesNotExist:
+            # Lookup o transform ('icontains', 'year'...): fin del path
+            return False
+        if not field.is_relation:
+            return False
+        if field.many_to_many or field.one_to_many:
+            return True
+        if field.related_model is None:
+            return False
+        model = field.related_model
+    return False
+
+
+def paths_list_display(list_display):
+    """Paths de texto de `list_display`: 'campo' o (label, 'campo'); los callables se omiten."""
+    paths = []
+    for item in list_display or ():
+        if isinstance(item, (list, tuple)) and len(item) == 2:
+            item = item[1]
+        if isinstance(item, str):
+            paths.append(item)
+    return tuple(dict.fromkeys(paths))
+
+
+def paths_export_fields(export_fields):
+    """Paths de texto de `export_fields`: 'campo' o tuple/list de campos concatenados."""
+    paths = []
+    for spec in export_fields or ():
+        if isinstance(spec, str):
+            paths.append(spec)
+        elif isinstance(spec, (list, tuple)):
+            paths.extend(p for p in spec if isinstance(p, str))
+    return tuple(dict.fromkeys(paths))
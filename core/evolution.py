@@ -1,5 +1,6 @@
 import re
 import logging
+import warnings
 import requests
 from typing import Optional
 from threading import Thread, Lock
@@ -8,8 +9,10 @@ from functools import wraps
 from evolutionapi.client import EvolutionClient
 from evolutionapi.models.message import TextMessage, ButtonMessage, Button
 
+from celery import shared_task
 from django.conf import settings
 from core.models import CredencialesAPI
+from core.outbox import registrar
 
 logger = logging.getLogger(__name__)
 
@@ -64,6 +67,16 @@ def normalize_ec_mobile(raw: str, *, return_plus: bool = False, raise_on_fail: b
     return ("+" + res) if return_plus else res
 
 def async_thread(func):
+    """
+    Obsoleto: ejecuta `func` en un hilo sin esperar el commit. Los envíos de este
+    módulo ya son asíncronos por el outbox. Se mantiene por compatibilidad.
+    """
+    warnings.warn(
+        "async_thread está obsoleto; los envíos de core.evolution ya pasan por el outbox",
+        DeprecationWarning,
+        stacklevel=2,
+    )
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         Thread(target=func, args=args, kwargs=kwargs).start()
@@ -128,14 +141,7 @@ def get_evolution_client(force_refresh: bool = False):
     """Interfaz pública para obtener el cliente Evolution y su configuración."""
     return _evolution_manager.get_client(force_refresh)
 
-@async_thread
-def send_whatsapp_text(number: str, text: str, delay: int = 0):
-    """
-    Enviar un mensaje de texto a través de WhatsApp (asíncrono).
-    number: número del receptor (incluyendo código de país) o ID de grupo (formato @g.us)
-    text: texto del mensaje
-    delay: retraso opcional en milisegundos
-    """
+def _send_whatsapp_text(number: str, text: str, delay: int = 0):
     try:
         # Verificar si es un grupo de WhatsApp (termina en @g.us) o un número normal
         if number.endswith('@g.us'):
@@ -157,17 +163,7 @@ def send_whatsapp_text(number: str, text: str, delay: int = 0):
         logger.error(f"Error al enviar mensaje de WhatsApp a {number}: {e}")
 
 
-@async_thread
-def send_whatsapp_buttons(number: str, title: str, description: str, footer: str, buttons: list, delay: int = 0):
-    """
-    Enviar botones a través de WhatsApp (asíncrono).
-    number: número del receptor (incluyendo código de país) o ID de grupo (formato @g.us)
-    title: título del mensaje
-    description: texto principal del mensaje
-    footer: texto en la parte inferior
-    buttons: lista de dicts con estructura {"type": "reply"|"url"|"phoneNumber"|"copyCode", ...}
-    delay: retraso opcional en milisegundos
-    """
+def _send_whatsapp_buttons(number: str, title: str, description: str, footer: str, buttons: list, delay: int = 0):
     try:
         # Verificar si es un grupo de WhatsApp (termina en @g.us) o un número normal
         if number.endswith('@g.us'):
@@ -200,6 +196,41 @@ def send_whatsapp_buttons(number: str, title: str, description: str, footer: str
         logger.error(f"Error al enviar botones de WhatsApp a {number}: {e}")
 
 
+@shared_task
+def send_whatsapp_text_task(number: str, text: str, delay: int = 0):
+    _send_whatsapp_text(number, text, delay)
+
+
+@shared_task
+def send_whatsapp_buttons_task(number: str, title: str, description: str, footer: str, buttons: list, delay: int = 0):
+    _send_whatsapp_buttons(number, title, description, footer, buttons, delay)
+
+
+def send_whatsapp_text(number: str, text: str, delay: int = 0):
+    """
+    Enviar un mensaje de texto a través de WhatsApp (asíncrono, después del commit de la
+    transacción actual; ver core/outbox.py).
+    number: número del receptor (incluyendo código de país) o ID de grupo (formato @g.us)
+    text: texto del mensaje
+    delay: retraso opcional en milisegundos
+    """
+    registrar(send_whatsapp_text_task, number, text, delay)
+
+
+def send_whatsapp_buttons(number: str, title: str, description: str, footer: str, buttons: list, delay: int = 0):
+    """
+    Enviar botones a través de WhatsApp (asíncrono, después del commit de la
+    transacción actual; ver core/outbox.py).
+    number: número del receptor (incluyendo código de país) o ID de grupo (formato @g.us)
+    title: título del mensaje
+    description: texto principal del mensaje
+    footer: texto en la parte inferior
+    buttons: lista de dicts con estructura {"type": "reply"|"url"|"phoneNumber"|"copyCode", ...}
+    delay: retraso opcional en milisegundos
+    """
+    registrar(send_whatsapp_buttons_task, number, title, description, footer, buttons, delay)
+
+
 def send_whatsapp_text_sync(number: str, text: str, delay: int = 0):
     """
     Enviar un mensaje de texto a través de WhatsApp de forma síncrona.
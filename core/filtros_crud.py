@@ -0,0 +1,171 @@
+"""
+Opciones de los filtros laterales de `ModelCRUDView` (`list_filter`), cacheadas.
+
+- Relaciones: se leen como máximo `FILTROS_MAX_OPCIONES` + 1 objetos. Si hay más, el
+  filtro pasa a un select con autocompletado contra `core:model_autocomplete` en lugar
+  de cargar toda la tabla relacionada (p.ej. todos los usuarios).
+- Campos simples: `values_list(...).distinct()` con el mismo límite; si hay más valores
+  distintos el filtro pasa a un campo de texto.
+
+Las opciones se guardan en el cache compartido (`FILTROS_CACHE_TTL` segundos). Las que
+dependen de otro modelo (objetos de una relación, valores de un lookup
+'relacion__campo') llevan una versión de ese modelo que se renueva en signals.py al
+guardar o borrar una de sus filas (los modelos se registran al definir cada
+`ModelCRUDView`). Los valores de un campo propio del modelo de la vista solo expiran
+con el TTL: así las tablas con muchas escrituras (`ErrorApp`, `NotificacionUsuario`)
+no pagan una invalidación por escritura. Los procesos que no importan las vistas (p.ej.
+un worker de Celery) tampoco invalidan: en ese caso el TTL es el límite de
+desactualización.
+
+Settings (opcionales):
+    FILTROS_MAX_OPCIONES = 50
+    FILTROS_CACHE_TTL = 300
+"""
+import time
+
+from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+
+CACHE_PREFIX = 'core:filtros'
+
+TIPO_LISTA = 'lista'
+TIPO_AUTOCOMPLETE = 'autocomplete'
+TIPO_TEXTO = 'texto'
+
+# Modelos de los que dependen opciones cacheadas en este proceso
+modelos_vigilados = set()
+
+
+def _label(model):
+    return model._meta.label_lower
+
+
+def _max_opciones():
+    return getattr(settings, 'FILTROS_MAX_OPCIONES', 50)
+
+
+def _version(model):
+    key = f'{CACHE_PREFIX}:version:{_label(model)}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key) or 0
+    return version
+
+
+def vigilar_modelo(model):
+    modelos_vigilados.add(model)
+
+
+def vigilar_filtros(model, list_filter):
+    """Registra los modelos relacionados de los que dependen las opciones de `list_filter`."""
+    from .views import _get_field_from_path
+
+    for filter_item in list_filter or ():
+        path = filter_item[1] if isinstance(filter_item, tuple) else filter_item
+        try:
+            field, final_model = _get_field_from_path(model, path)
+        except Exception:
+            continue
+        if field.is_relation or final_model is not model:
+            vigilar_modelo(final_model)
+
+
+def invalidar_opciones_filtro(model):
+    """Renueva la versión de `model` al confirmar la transacción."""
+    key = f'{CACHE_PREFIX}:version:{_label(model)}'
+    transaction.on_commit(lambda: cache.set(key, time.time_ns(), None))
+
+
+def _cacheado(model, nombre, cargar):
+    """`model`: modelo cuya versión invalida el valor (None: solo expira con el TTL)."""
+    if model is None:
+        key = f'{CACHE_PREFIX}:{nombre}'
+    else:
+        vigilar_modelo(model)
+        key = f'{CACHE_PREFIX}:{_label(model)}:{_version(model)}:{nombre}'
+    valor = cache.get(key)
+    if valor is None:
+        valor = cargar()
+        cache.set(key, valor, getattr(settings, 'FILTROS_CACHE_TTL', 60 * 5))
+    return valor
+
+
+def opciones_relacion(related_model):
+    """(tipo, choices): lista [(pk, str)] o TIPO_AUTOCOMPLETE si hay demasiados objetos."""
+    limite = _max_opciones()
+
+    def cargar():
+        objetos = list(related_model._default_manager.all()[:limite + 1])
+        if len(objetos) > limite:
+            return TIPO_AUTOCOMPLETE, []
+        return TIPO_LISTA, [(obj.pk, str(obj)) for obj in objetos]
+
+    return _cacheado(related_model, 'relacion', cargar)
+
+
+def opciones_valores(model, path, modelo_campo=None):
+    """
+    (tipo, choices): valores distintos de `path` o TIPO_TEXTO si hay demasiados.
+    `modelo_campo`: modelo del campo final; si es otro (lookup 'relacion__campo') sus
+    cambios invalidan las opciones, si es `model` solo expiran con el TTL.
+    """
+    limite = _max_opciones()
+
+    def cargar():
+        valores = list(
+            model._default_manager.values_list(path, flat=True)
+            .distinct().order_by()[:limite + 1]
+        )
+        if len(valores) > limite:
+            return TIPO_TEXTO, []
+        return TIPO_LISTA, [(v, v) for v in valores if v is not None]
+
+    modelo_version = modelo_campo if modelo_campo not in (None, model) else None
+    return _cacheado(modelo_version, f'valores:{_label(model)}:{path}', cargar)
+
+
+def campos_busqueda(model):
+    """`search_fields` de la vista CRUD registrada del modelo, o sus campos de texto."""
+    from .crud_registry import crud_registry
+
+    info = crud_registry.get(model)
+    search_fields = getattr(info.get('view'), 'search_fields', None) if info else None
+    if search_fields:
+        return list(search_fields)
+    return [
+        f.name for f in model._meta.get_fields()
+        if isinstance(f, (models.CharField, models.TextField)) and not f.choices and f.name != 'password'
+    ][:3]
+
+
+def widget_autocomplete(related_model, field_name, value):
+    """
+    Select con autocompletado (django-autocomplete-light) contra `core:model_autocomplete`.
+    Retorna el campo de formulario enlazado; solo se consulta el objeto seleccionado.
+    None si el modelo no tiene campos por los que buscar.
+    """
+    from dal import autocomplete, forward
+
+    search_fields = campos_busqueda(related_model)
+    if not search_fields:
+        return None
+
+    form_class = type('FiltroAutocompleteForm', (forms.Form,), {
+        field_name: forms.ModelChoiceField(
+            queryset=related_model._default_manager.all(),
+            required=False,
+            widget=autocomplete.ModelSelect2(
+                url='core:model_autocomplete',
+                forward=(
+                    forward.Const(related_model._meta.label, 'model'),
+                    forward.Const(search_fields, 'search_fields'),
+                ),
+                attrs={'data-placeholder': 'Buscar...', 'class': 'form-select form-select-sm'},
+            ),
+        ),
+    })
+    form = form_class(initial={field_name: value or None})
+    return form[field_name]
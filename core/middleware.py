@@ -0,0 +1,108 @@
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:  # asgiref < 3.6
+    iscoroutinefunction = asyncio.iscoroutinefunction
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
+
+
+# ContextVar funciona igual en WSGI (un contexto por hilo), ASGI (uno por tarea)
+# y Celery (la tarea corre en el contexto del worker).
+_current_request = ContextVar('core_current_request', default=None)
+_current_user = ContextVar('core_current_user', default=None)
+
+
+def get_current_request():
+    """Retorna el request que se está procesando en el contexto actual (o None)."""
+    return _current_request.get()
+
+
+def get_current_user():
+    """
+    Retorna el usuario de auditoría del contexto actual:
+    primero el fijado con `audit_user`, luego `request.user`.
+    """
+    user = _current_user.get()
+    if user is not None:
+        return user
+    request = _current_request.get()
+    return getattr(request, 'user', None) if request is not None else None
+
+
+def get_audit_user_id():
+    """
+    Id del usuario que se registra en `created_by` / `modified_by`.
+    Fuera de un request o de `audit_user` usa `settings.AUDIT_DEFAULT_USER_ID` (1 por defecto).
+    """
+    user = _current_user.get()
+    if user is not None:
+        return user if isinstance(user, int) else user.pk
+
+    request = _current_request.get()
+    if request is not None:
+        user = getattr(request, 'user', None)
+        return getattr(user, 'id', None)
+
+    return getattr(settings, 'AUDIT_DEFAULT_USER_ID', 1)
+
+
+@contextmanager
+def audit_user(user):
+    """
+    Fija el usuario de auditoría para scripts, comandos y tareas de Celery.
+
+        with audit_user(request.user):
+            ...
+        with audit_user(user_id):
+            ...
+    """
+    token = _current_user.set(user)
+    try:
+        yield user
+    finally:
+        _current_user.reset(token)
+
+
+class CurrentRequestMiddleware:
+    """
+    Publica el request actual en un ContextVar para que `ModeloBase.save`
+    pueda leer el usuario en O(1). Agregar después de AuthenticationMiddleware:
+
+        MIDDLEWARE = [
+            ...
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+            'core.middleware.CurrentRequestMiddleware',
+        ]
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._async_mode = iscoroutinefunction(get_response)
+        if self._async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._async_mode:
+            return self.__acall__(request)
+        token = _current_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _current_request.reset(token)
+
+    async def __acall__(self, request):
+        token = _current_request.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            _current_request.reset(token)
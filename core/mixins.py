@@ -2,12 +2,20 @@ from django.contrib import messages
 from django.contrib.auth.mixins import AccessMixin
 from django.shortcuts import redirect
 from django.utils.translation import gettext_lazy as trans
-from core.models import GrupoModulo, Modulo
+from core.cache_modulos import path_permitido
 
-def has_access_module(request):
+# Las rutas en `RUTAS_PERMITIDAS` siempre deben permitirse
+RUTAS_PERMITIDAS = ('/administracion/', '/usuario/')
+
+
+def has_access_module(request, modo=None):
     """
     Retorna True si el usuario pertenece a un grupo que tenga un Modulo
-    cuyo `url` coincida (o esté contenida) en `path`. De lo contrario False.
+    cuyo `url` coincida con `path`. De lo contrario False.
+
+    `modo` define la coincidencia: 'contains' (la url está contenida en el path,
+    por defecto) o 'prefix' (el path empieza con la url). Ver `settings.MODULOS_URL_MATCH`.
+    Los grupos y las urls se leen del cache compartido: sin consultas en régimen estable.
     """
     user = request.user
     path = request.path
@@ -17,30 +25,16 @@ def has_access_module(request):
     elif user.is_superuser:
         return True
 
-    # Obtenemos los ID de los grupos a los que pertenece el usuario
-    group_ids = user.groups.values_list('id', flat=True)
-
-    # Recuperamos todas las URLs de 'modulos' asociadas a esos grupos
-    # (usando tu modelo GrupoModulo como nexo)
-    modulos_urls = GrupoModulo.objects.filter(
-        grupo_id__in=group_ids
-    ).values_list('modulos__url', flat=True)
-
-    permitidas = ['/administracion/', '/usuario/']
-    # Las rutas en `permitidas` siempre deben permitirse
-    for p in permitidas:
-        if path.startswith(p):
-            return True
- 
-    for modulo_url in modulos_urls:
-        # if modulo_url and path.startswith(modulo_url):
-        if modulo_url and modulo_url in path:
-            return True
+    if path.startswith(RUTAS_PERMITIDAS):
+        return True
 
-    return False
+    return path_permitido(user, path, modo)
 
 
 class SecureModuleMixin(AccessMixin):
+    # 'contains' | 'prefix'; None usa settings.MODULOS_URL_MATCH
+    module_url_match = None
+
     def handle_no_permission(self):
         # Si esta logueado pero no tiene acceso a la vista redirigir al inicio
         if self.request.user.is_authenticated:
@@ -51,7 +45,7 @@ class SecureModuleMixin(AccessMixin):
         has_access, error_message = False, None
 
         try:
-            has_access = request.user.is_authenticated and has_access_module(request)
+            has_access = request.user.is_authenticated and has_access_module(request, self.module_url_match)
         except Exception as ex:
             print(ex)
             error_message = request.user.is_superuser and str(ex)
@@ -1,9 +1,8 @@
-import datetime, inspect
-
 from django.db import models
 from django.db import models
 from django.contrib.auth.models import AbstractUser, Group
 from django.db.models import Q
+from django.utils import timezone
 from django.utils.functional import cached_property
 
 from allauth.socialaccount.models import SocialAccount
@@ -11,6 +10,8 @@ from allauth.account.models import EmailAddress
 from django_resized import ResizedImageField
 from tinymce import models as tinymce_models
 
+from .middleware import get_audit_user_id
+
 
 class CustomUser(AbstractUser):
     premium = models.BooleanField(default=False)
@@ -49,73 +50,13 @@ class CustomUser(AbstractUser):
     @cached_property
     def mis_modulos_y_agrupaciones(self):
         """
-        Método optimizado que retorna en una sola consulta:
-        - Agrupaciones con sus módulos filtrados por permisos del usuario
+        Retorna, desde el cache compartido por conjunto de grupos:
+        - Agrupaciones con sus módulos permitidos en `modulos_permitidos`
         - Lista de IDs de módulos a los que tiene acceso
         """
-        if self.is_superuser:
-            # Para superusuario: todas las agrupaciones con todos sus módulos activos
-            agrupaciones = (
-                AgrupacionModulo.objects
-                .prefetch_related('modulos')
-                .order_by('orden', 'nombre')
-            )
-            modulos_ids = set(Modulo.objects.values_list('id', flat=True))
-            
-            # Filtrar agrupaciones que tienen módulos activos
-            agrupaciones_con_modulos = []
-            for agrupacion in agrupaciones:
-                modulos_activos = agrupacion.modulos_activos
-                if modulos_activos:
-                    agrupaciones_con_modulos.append(agrupacion)
-            
-            return {
-                'agrupaciones': agrupaciones_con_modulos,
-                'modulos_ids': modulos_ids
-            }
-        
-        else:
-            # Para usuario normal: una sola consulta optimizada
-            user_groups = self.groups.all()
-            
-            # Obtener agrupaciones con módulos filtrados en una consulta
-            agrupaciones = (
-                AgrupacionModulo.objects
-                .filter(modulos__grupomodulo__grupo__in=user_groups)
-                .prefetch_related(
-                    models.Prefetch(
-                        'modulos',
-                        queryset=Modulo.objects.filter(
-                            activo=True,
-                            grupomodulo__grupo__in=user_groups
-                        ).distinct().order_by('orden'),
-                        to_attr='modulos_permitidos'
-                    )
-                )
-                .distinct()
-                .order_by('orden', 'nombre')
-            )
-            
-            # Obtener IDs de módulos permitidos
-            modulos_ids = set(
-                Modulo.objects
-                .filter(grupomodulo__grupo__in=user_groups, activo=True)
-                .distinct()
-                .values_list('id', flat=True)
-            )
-            
-            # Filtrar agrupaciones que tienen al menos un módulo permitido
-            agrupaciones_con_modulos = []
-            for agrupacion in agrupaciones:
-                modulos_permitidos = getattr(agrupacion, 'modulos_permitidos', [])
-                if modulos_permitidos:
-                    agrupaciones_con_modulos.append(agrupacion)
-            
-            return {
-                'agrupaciones': agrupaciones_con_modulos,
-                'modulos_ids': modulos_ids
-            }   
-                
+        from .cache_modulos import menu_modulos_usuario
+        return menu_modulos_usuario(self)
+
     @staticmethod
     def flexbox_query(query):
         return CustomUser.objects.filter(Q(first_name__search=query) | Q(first_name__icontains=query) | 
@@ -123,6 +64,43 @@ class CustomUser(AbstractUser):
                                          Q(username__icontains=query))
 
 
+class ModeloBaseQuerySet(models.QuerySet):
+    """
+    QuerySet con escrituras masivas que completan los campos de auditoría
+    (`created_by`, `modified_by`, `created_at`, `modified_at`) sin pasar por `save()`.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        user_id = get_audit_user_id()
+        now = timezone.now()
+        for obj in objs:
+            if not obj.created_by_id:
+                obj.created_by_id = user_id
+            if obj.created_at is None:
+                obj.created_at = now
+            obj.modified_by_id = user_id
+            obj.modified_at = now
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        user_id = get_audit_user_id()
+        now = timezone.now()
+        for obj in objs:
+            obj.modified_by_id = user_id
+            obj.modified_at = now
+        fields = list(dict.fromkeys(list(fields) + ['modified_by', 'modified_at']))
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        # bulk_update() llega aquí con los campos de auditoría ya resueltos en CASE.
+        if 'modified_by' not in kwargs and 'modified_by_id' not in kwargs:
+            kwargs['modified_by_id'] = get_audit_user_id()
+        kwargs.setdefault('modified_at', timezone.now())
+        return super().update(**kwargs)
+
+
 class ModeloBase(models.Model):
     """
     Clase base para todos los modelos de la aplicación.
@@ -132,21 +110,17 @@ class ModeloBase(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
 
+    objects = ModeloBaseQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
 
         if self.created_at is None:
-            self.created_at = datetime.datetime.now()
+            self.created_at = timezone.now()
 
-        for frame_record in inspect.stack():
-            if frame_record[3]=='get_response':
-                request = frame_record[0].f_locals['request']
-                break
-            else:
-                request = None
+        # Usuario del request (CurrentRequestMiddleware) o de `audit_user(...)`
+        user_id = get_audit_user_id()
 
-        user_id = request.user.id if request else 1
-        
-        if not self.pk and not self.created_by:
+        if not self.pk and not self.created_by_id:
             self.created_by_id = user_id
         self.modified_by_id = user_id
         super(ModeloBase, self).save(*args, **kwargs)
@@ -348,6 +322,9 @@ class AvisoMasivo(ModeloBase):
         ordering = ['-publicado_en', '-id']
         verbose_name = "Aviso masivo"
         verbose_name_plural = "Avisos masivos"
+        indexes = [
+            models.Index(fields=['activo', 'publicado_en']),
+        ]
 
     def __str__(self):
         return self.titulo
@@ -375,6 +352,117 @@ class AvisoMasivoLectura(models.Model):
         return f"{self.usuario_id} → {self.aviso_id}"
 
 
+class AvisoMasivoMarcaLectura(models.Model):
+    """
+    Marca de lectura por usuario: todo aviso creado y publicado hasta `leido_hasta`
+    cuenta como leído sin filas en AvisoMasivoLectura. Se usa con
+    `settings.AVISOS_MASIVOS_MARCA_LECTURA = True`.
+    """
+    usuario = models.OneToOneField(
+        CustomUser, on_delete=models.CASCADE, related_name='avisos_masivos_marca_lectura',
+    )
+    leido_hasta = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Marca de lectura de avisos masivos"
+        verbose_name_plural = "Marcas de lectura de avisos masivos"
+
+    def __str__(self):
+        return f"{self.usuario_id} → {self.leido_hasta}"
+
+
+class CampanaPush(ModeloBase):
+    """
+    Envío Web Push masivo a un grupo, con métricas que los despachadores actualizan
+    por lotes mientras corre (ver core/campanas_push.py).
+    """
+    ESTADO_PENDIENTE = 'pendiente'
+    ESTADO_ENVIANDO = 'enviando'
+    ESTADO_FINALIZADA = 'finalizada'
+    ESTADOS = (
+        (ESTADO_PENDIENTE, 'Pendiente'),
+        (ESTADO_ENVIANDO, 'Enviando'),
+        (ESTADO_FINALIZADA, 'Finalizada'),
+    )
+
+    codigo = models.CharField(max_length=64, unique=True)
+    grupo = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=ESTADO_PENDIENTE)
+    inicio = models.DateTimeField(null=True, blank=True)
+    fin = models.DateTimeField(null=True, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    enviadas = models.PositiveIntegerField(default=0)
+    eliminadas = models.PositiveIntegerField(default=0)
+    fallidas = models.PositiveIntegerField(default=0)
+    reprogramadas = models.PositiveIntegerField(default=0)
+    latencia_p50_ms = models.FloatField(null=True, blank=True)
+    latencia_p95_ms = models.FloatField(null=True, blank=True)
+    # {límite_ms: cantidad}; se fusiona entre tramos para recalcular p50/p95
+    histograma_latencia = models.JSONField(default=dict, blank=True)
+    # {origen: {"throttled": n, "transient": n, "failed": n}}
+    errores_por_origen = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Campaña push"
+        verbose_name_plural = "Campañas push"
+
+    def __str__(self):
+        return f"{self.grupo} - {self.payload.get('head', '')} ({self.codigo})"
+
+
+class LimpiezaSuscripcionPush(models.Model):
+    """Suscripciones push muertas (404/410) eliminadas por campaña de envío."""
+    campana = models.CharField(max_length=64, unique=True)
+    eliminadas = models.PositiveIntegerField(default=0)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-actualizado_en']
+        verbose_name = "Limpieza de suscripciones push"
+        verbose_name_plural = "Limpiezas de suscripciones push"
+
+    def __str__(self):
+        return f"{self.campana}: {self.eliminadas}"
+
+
+class EnvioCampanaPush(models.Model):
+    """Destinatario ya procesado de una campaña push: los reintentos no le vuelven a enviar."""
+    campana = models.CharField(max_length=64)
+    push_information_id = models.BigIntegerField()
+    estado = models.CharField(max_length=10)
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (('campana', 'push_information_id'),)
+        indexes = [models.Index(fields=['creado_en'])]
+        verbose_name = "Envío de campaña push"
+        verbose_name_plural = "Envíos de campañas push"
+
+    def __str__(self):
+        return f"{self.campana}: {self.push_information_id} ({self.estado})"
+
+
+class OutboxMensaje(models.Model):
+    """Tarea Celery registrada dentro de una transacción; se entrega tras el commit (core/outbox.py)."""
+    tarea = models.CharField(max_length=255)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    enviado_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['enviado_en', 'id'])]
+        verbose_name = "Mensaje del outbox"
+        verbose_name_plural = "Outbox de mensajes"
+
+    def __str__(self):
+        return f"{self.tarea} #{self.pk}"
+
+
 class ErrorApp(ModeloBase):
     path = models.CharField(max_length=255)
     url = models.CharField(max_length=255)
@@ -1,17 +1,35 @@
+import base64
+import hashlib
+import heapq
+import itertools
 import json
 import logging
+import math
+import re
+import threading
 import time
-from datetime import datetime, timezone
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
 
-from celery import shared_task
+from celery import chord, shared_task
 from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone as dj_timezone
 from django.forms.models import model_to_dict
 from pywebpush import WebPushException, webpush
 
-from webpush.models import Group
-from .models import CustomUser
+from webpush.models import Group, PushInformation, SubscriptionInfo
+from .campanas_push import MetricasCampana, finalizar_campana, iniciar_campana, registrar_campana
+from .models import CampanaPush, CustomUser, EnvioCampanaPush, LimpiezaSuscripcionPush
+from .outbox import registrar
+from .tareas import broker_disponible, publicar
+from .webpush_sender import session_for, vapid_headers
 
 logger = logging.getLogger(__name__)
 
@@ -46,122 +64,443 @@ def _get_vapid_data():
     return {}
 
 
+# Urgency (RFC 8030 §5.3): el servicio push puede retener los mensajes de baja urgencia
+# hasta que el dispositivo esté activo o cargando.
+URGENCIAS = ("very-low", "low", "normal", "high")
+_TOPIC_RE = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+
+def _push_headers(topic=None, urgency=None):
+    """
+    Cabeceras Topic/Urgency para el servicio push (None si no hay ninguna).
+    Con Topic, un mensaje pendiente del mismo topic se reemplaza en vez de acumularse;
+    los topics que no cumplen RFC 8030 (máx. 32 caracteres base64url) se resumen con sha256.
+    """
+    headers = {}
+    if topic:
+        topic = str(topic)
+        if not _TOPIC_RE.match(topic):
+            digest = hashlib.sha256(topic.encode("utf-8")).digest()
+            topic = base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")[:32]
+        headers["Topic"] = topic
+    if urgency:
+        if urgency not in URGENCIAS:
+            raise ValueError(f"Urgency de Web Push no válida: {urgency!r}")
+        headers["Urgency"] = urgency
+    return headers or None
+
+
+def _resolve_ttl(ttl):
+    """`ttl=None` usa `settings.WEBPUSH_DEFAULT_TTL` (0: el servicio no guarda el mensaje)."""
+    return getattr(settings, "WEBPUSH_DEFAULT_TTL", 0) if ttl is None else ttl
+
+
+def _payload_json(payload):
+    """
+    JSON compacto del payload (sin claves vacías, UTF-8 sin escapar). Si supera
+    `WEBPUSH_MAX_PAYLOAD_BYTES` se recorta el `body`, que es lo único prescindible.
+    """
+    payload = {key: value for key, value in payload.items() if value not in (None, "")}
+    max_bytes = getattr(settings, "WEBPUSH_MAX_PAYLOAD_BYTES", 3800)
+    data = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+    exceso = len(data.encode("utf-8")) - max_bytes
+    body = payload.get("body")
+    if exceso > 0 and isinstance(body, str):
+        body_bytes = body.encode("utf-8")
+        payload["body"] = body_bytes[:max(0, len(body_bytes) - exceso - 3)].decode("utf-8", "ignore") + "…"
+        data = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+    if len(data.encode("utf-8")) > max_bytes:
+        logger.warning("[WebPush WARN] Payload de %s bytes: el servicio push puede rechazarlo", len(data.encode("utf-8")))
+    return data
+
+
+def _retry_after_seconds(response, default=5):
+    """Retry-After en segundos (entero o fecha HTTP), acotado a WEBPUSH_RETRY_AFTER_MAX_SECONDS."""
+    raw = response.headers.get("Retry-After") if response is not None else None
+    try:
+        seconds = int(raw)
+    except (TypeError, ValueError):
+        try:
+            retry_after_dt = parsedate_to_datetime(raw)
+            if retry_after_dt.tzinfo is None:
+                retry_after_dt = retry_after_dt.replace(tzinfo=timezone.utc)
+            seconds = int((retry_after_dt - datetime.now(timezone.utc)).total_seconds())
+        except Exception:
+            seconds = default
+
+    max_retry_after = getattr(settings, "WEBPUSH_RETRY_AFTER_MAX_SECONDS", 60)
+    return max(1, min(seconds, max_retry_after))
+
+
+# Resultados de `_dispatch_webpush` que se reintentan más tarde
+RETRY_STATUSES = ("throttled", "transient")
+
+
 def _dispatch_webpush(
-    recipient,
-    payload_json,
-    vapid_data,
-    ttl=0,
-    es_reintento=False,
-    transient_attempt=0,
+    recipient, payload_json, vapid_data, ttl=0, eliminar_suscripcion=True, headers=None
 ):
     """
-    Lógica central de envío con manejo de limpieza (404/410) y bloqueos (429).
+    Un intento de envío, sin esperas. Retorna `(status, retry_after)`:
+
+    - "sent"
+    - "deleted": 404/410. Borra la suscripción salvo con `eliminar_suscripcion=False`
+      (el llamador la borra, p.ej. desde el hilo principal del despachador concurrente).
+    - "throttled": 429; `retry_after` son los segundos indicados en Retry-After.
+    - "transient": 5xx o sin respuesta del servicio push.
+    - "failed"
+
+    Los reintentos de "throttled"/"transient" los programa `WebPushDispatcher`
+    sin frenar el envío al resto de servicios push.
+
+    La cabecera VAPID y la sesión HTTP (keep-alive) por origen se reutilizan entre
+    envíos (ver webpush_sender.py). `headers` lleva Topic/Urgency (`_push_headers`).
     """
     subscription_data = _process_subscription_info(recipient.subscription)
+    origin = _push_origin(recipient)
     try:
         webpush(
             subscription_info=subscription_data,
             data=payload_json,
             ttl=ttl,
-            **vapid_data,
+            headers={**(headers or {}), **vapid_headers(subscription_data["endpoint"], vapid_data)},
+            requests_session=session_for(origin, _origin_concurrency(origin)[1]),
+            timeout=getattr(settings, "WEBPUSH_TIMEOUT", 10),
         )
         logger.info("[WebPush OK] %s", recipient)
-        return "sent"
-        
+        return "sent", 0
+
     except WebPushException as exc:
-        if exc.response is not None:
-            status_code = exc.response.status_code
-            
-            # 1. LIMPIEZA: 410 (Gone) o 404 (Not Found) -> Borramos la suscripción
-            if status_code in [404, 410]:
-                logger.warning("[WebPush %s] Borrando suscripción muerta: %s", status_code, recipient)
-                recipient.subscription.delete()
-                return "deleted"
-                
-            # 2. BLOQUEO (RATE LIMITING): 429 (Too Many Requests) -> Pausamos
-            elif status_code == 429 and not es_reintento:
-                # Retry-After puede venir en segundos o como fecha HTTP.
-                retry_after_raw = exc.response.headers.get("Retry-After", "5")
-                retry_after = 5
-                try:
-                    retry_after = int(retry_after_raw)
-                except (TypeError, ValueError):
-                    try:
-                        retry_after_dt = parsedate_to_datetime(retry_after_raw)
-                        if retry_after_dt.tzinfo is None:
-                            retry_after_dt = retry_after_dt.replace(tzinfo=timezone.utc)
-                        retry_after = int(
-                            (retry_after_dt - datetime.now(timezone.utc)).total_seconds()
-                        )
-                    except Exception:
-                        retry_after = 5
-
-                max_retry_after = getattr(settings, "WEBPUSH_RETRY_AFTER_MAX_SECONDS", 60)
-                retry_after = max(1, min(retry_after, max_retry_after))
-                logger.warning("[WebPush 429] Google nos frena. Pausando %s segundos...", retry_after)
-                time.sleep(retry_after)
-                
-                # Volvemos a intentar enviar a este mismo usuario una vez más
-                return _dispatch_webpush(recipient, payload_json, vapid_data, ttl, es_reintento=True)
-
-            # 3. ERRORES TRANSITORIOS DEL PROVEEDOR (5xx): reintento corto con backoff.
-            elif status_code in [500, 502, 503, 504]:
-                max_attempts = getattr(settings, "WEBPUSH_TRANSIENT_MAX_ATTEMPTS", 3)
-                if transient_attempt < max_attempts - 1:
-                    wait_seconds = min(2 ** transient_attempt, 8)
-                    logger.warning(
-                        "[WebPush %s] Error transitorio para %s. Reintento %s/%s en %ss",
-                        status_code,
-                        recipient,
-                        transient_attempt + 1,
-                        max_attempts - 1,
-                        wait_seconds,
-                    )
-                    time.sleep(wait_seconds)
-                    return _dispatch_webpush(
-                        recipient,
-                        payload_json,
-                        vapid_data,
-                        ttl,
-                        es_reintento=es_reintento,
-                        transient_attempt=transient_attempt + 1,
-                    )
-
-        # Cualquier otro error (500, etc)
-        status = exc.response.status_code if exc.response else "No response"
         if exc.response is None:
-            max_attempts = getattr(settings, "WEBPUSH_TRANSIENT_MAX_ATTEMPTS", 3)
-            if transient_attempt < max_attempts - 1:
-                wait_seconds = min(2 ** transient_attempt, 8)
-                logger.warning(
-                    "[WebPush WARN] Sin respuesta para %s. Reintento %s/%s en %ss. Detalle: %s",
-                    recipient,
-                    transient_attempt + 1,
-                    max_attempts - 1,
-                    wait_seconds,
-                    exc,
-                )
-                time.sleep(wait_seconds)
-                return _dispatch_webpush(
-                    recipient,
-                    payload_json,
-                    vapid_data,
-                    ttl,
-                    es_reintento=es_reintento,
-                    transient_attempt=transient_attempt + 1,
-                )
+            logger.warning("[WebPush WARN] Sin respuesta para %s. Detalle: %s", recipient, exc)
+            return "transient", 0
+
+        status_code = exc.response.status_code
+
+        # 1. LIMPIEZA: 410 (Gone) o 404 (Not Found) -> Borramos la suscripción
+        if status_code in [404, 410]:
+            logger.warning("[WebPush %s] Borrando suscripción muerta: %s", status_code, recipient)
+            if eliminar_suscripcion:
+                recipient.subscription.delete()
+            return "deleted", 0
+
+        # 2. BLOQUEO (RATE LIMITING): 429 (Too Many Requests) -> se difiere según Retry-After
+        if status_code == 429:
+            retry_after = _retry_after_seconds(exc.response)
+            logger.warning("[WebPush 429] %s: el servicio pide esperar %ss", recipient, retry_after)
+            return "throttled", retry_after
+
+        # 3. ERRORES TRANSITORIOS DEL PROVEEDOR (5xx)
+        if status_code in [500, 502, 503, 504]:
+            logger.warning("[WebPush %s] Error transitorio para %s", status_code, recipient)
+            return "transient", 0
 
         logger.error(
             "[WebPush ERROR] Usuario: %s, Status: %s, Detalle: %s",
             recipient,
-            status,
+            status_code,
             exc,
         )
-        return "failed"
-        
+        return "failed", 0
+
     except Exception:
         logger.exception("[WebPush Error] Error inesperado")
-        return "failed"
+        return "failed", 0
+
+
+class _OriginCircuitBreaker:
+    """
+    Circuit breaker por servicio push, compartido por los despachadores del proceso.
+    Un 429 lo abre durante el Retry-After; `WEBPUSH_BREAKER_THRESHOLD` errores
+    transitorios seguidos lo abren con backoff exponencial. Mientras está abierto,
+    los envíos a ese origen se difieren y los demás orígenes siguen normalmente.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._abierto_hasta = {}
+        self._fallos = {}
+
+    def espera(self, origin):
+        """Segundos que faltan para volver a enviar a `origin` (0 si está cerrado)."""
+        with self._lock:
+            return max(0.0, self._abierto_hasta.get(origin, 0) - time.monotonic())
+
+    def registrar(self, origin, status, retry_after=0):
+        with self._lock:
+            if status == "throttled":
+                self._abrir(origin, retry_after)
+            elif status == "transient":
+                fallos = self._fallos.get(origin, 0) + 1
+                self._fallos[origin] = fallos
+                umbral = getattr(settings, "WEBPUSH_BREAKER_THRESHOLD", 5)
+                if fallos >= umbral:
+                    self._abrir(origin, min(2 ** (fallos - umbral), 60))
+            else:
+                # El servicio respondió: se reinicia la racha de errores
+                self._fallos.pop(origin, None)
+
+    def _abrir(self, origin, segundos):
+        hasta = time.monotonic() + segundos
+        if hasta > self._abierto_hasta.get(origin, 0):
+            logger.warning("[WebPush BREAKER] %s en pausa %ss", origin, segundos)
+            self._abierto_hasta[origin] = hasta
+
+
+_breaker = _OriginCircuitBreaker()
+
+
+# Concurrencia por defecto por servicio push (origen del endpoint).
+# Se sobrescribe/extiende con settings.WEBPUSH_CONCURRENCY_PER_ORIGIN.
+WEBPUSH_CONCURRENCY_PER_ORIGIN = {
+    "fcm.googleapis.com": 32,
+    "updates.push.services.mozilla.com": 8,
+    "web.push.apple.com": 8,
+}
+
+
+def _push_origin(recipient):
+    return urlparse(recipient.subscription.endpoint or "").netloc.lower()
+
+
+def _origin_concurrency(origin):
+    """(clave del pool, hilos) del origen; los orígenes sin límite propio comparten "*"."""
+    limits = {
+        **WEBPUSH_CONCURRENCY_PER_ORIGIN,
+        **getattr(settings, "WEBPUSH_CONCURRENCY_PER_ORIGIN", {}),
+    }
+    if origin in limits:
+        return origin, max(1, limits[origin])
+    return "*", max(1, getattr(settings, "WEBPUSH_DEFAULT_CONCURRENCY", 4))
+
+
+class WebPushDispatcher:
+    """
+    Envío concurrente de Web Push: un pool de hilos acotado por cada servicio push
+    (FCM, Mozilla, Apple...), así un servicio lento no frena a los demás.
+    Los orígenes sin límite configurado comparten un pool de
+    `WEBPUSH_DEFAULT_CONCURRENCY` hilos. `WEBPUSH_MAX_IN_FLIGHT` acota los envíos
+    pendientes en memoria.
+
+    Los 429/5xx no bloquean: el destinatario pasa a una cola de reintentos ordenada
+    por vencimiento (Retry-After o backoff) y el envío sigue con los demás. Al cerrar,
+    los reintentos que vencen en más de `WEBPUSH_RETRY_INLINE_MAX_SECONDS` se
+    reprograman en Celery con `countdown` si `reprogramar=True`; si no, se esperan aquí.
+
+    Acumula `sent/deleted/failed/rescheduled` en `report` y, con `campaign_id`, en las
+    métricas de la `CampanaPush` (ver campanas_push.py). Las suscripciones muertas
+    (404/410) se acumulan y se borran por lotes (`WEBPUSH_DELETE_BATCH_SIZE`) desde el
+    hilo que llama, como mínimo al cerrar; ver `eliminar_suscripciones_muertas`.
+    """
+
+    def __init__(
+        self,
+        payload_json,
+        vapid_data,
+        ttl=0,
+        report=None,
+        on_result=None,
+        reprogramar=False,
+        campaign_id=None,
+        headers=None,
+    ):
+        self.payload_json = payload_json
+        self.headers = headers
+        self.vapid_data = vapid_data
+        self.ttl = ttl
+        self.report = report if report is not None else {}
+        for key in ("sent", "deleted", "failed", "rescheduled"):
+            self.report.setdefault(key, 0)
+        self.on_result = on_result
+        self.reprogramar = reprogramar
+        self.campaign_id = campaign_id
+        self.metricas = MetricasCampana(campaign_id) if campaign_id else None
+
+        self.max_attempts = getattr(settings, "WEBPUSH_TRANSIENT_MAX_ATTEMPTS", 3)
+        self._in_flight = threading.BoundedSemaphore(getattr(settings, "WEBPUSH_MAX_IN_FLIGHT", 500))
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._done = []
+        self._retries = []
+        self._seq = itertools.count()
+        self._dead = []
+        self.delete_batch_size = getattr(settings, "WEBPUSH_DELETE_BATCH_SIZE", 500)
+
+    def _pool_for(self, origin):
+        key, limit = _origin_concurrency(origin)
+        if key not in self._pools:
+            self._pools[key] = ThreadPoolExecutor(
+                max_workers=limit, thread_name_prefix=f"webpush-{key}"
+            )
+        return self._pools[key]
+
+    def _send(self, recipient, attempt):
+        inicio = time.monotonic()
+        try:
+            status, retry_after = _dispatch_webpush(
+                recipient,
+                self.payload_json,
+                self.vapid_data,
+                self.ttl,
+                eliminar_suscripcion=False,
+                headers=self.headers,
+            )
+        except Exception:
+            logger.exception("[WebPush Error] Error inesperado")
+            status, retry_after = "failed", 0
+        latencia_ms = (time.monotonic() - inicio) * 1000
+        with self._lock:
+            self._done.append((recipient, attempt, status, retry_after, latencia_ms))
+            self._pending -= 1
+            self._idle.notify_all()
+        self._in_flight.release()
+
+    def _schedule(self, recipient, attempt, delay):
+        heapq.heappush(
+            self._retries, (time.monotonic() + delay, next(self._seq), recipient, attempt)
+        )
+
+    def _collect(self):
+        with self._lock:
+            done, self._done = self._done, []
+        for recipient, attempt, status, retry_after, latencia_ms in done:
+            origin = _push_origin(recipient)
+            _breaker.registrar(origin, status, retry_after)
+            if self.metricas is not None:
+                self.metricas.intento(origin, status, latencia_ms)
+            if status in RETRY_STATUSES:
+                if attempt + 1 < self.max_attempts:
+                    delay = retry_after if status == "throttled" else min(2 ** attempt, 8)
+                    self._schedule(recipient, attempt + 1, delay)
+                    continue
+                logger.error("[WebPush ERROR] %s: sin éxito tras %s intentos", recipient, attempt + 1)
+                status = "failed"
+            if status == "deleted":
+                self._dead.append(recipient.subscription_id)
+                if len(self._dead) >= self.delete_batch_size:
+                    self._flush_dead()
+            self.report[status if status in ("sent", "deleted") else "failed"] += 1
+            if self.metricas is not None:
+                self.metricas.resultado(status)
+            if self.on_result is not None:
+                self.on_result(recipient, status)
+
+    def _flush_dead(self):
+        ids, self._dead = self._dead, []
+        if ids:
+            eliminar_suscripciones_muertas(ids, self.campaign_id)
+
+    def _drain_due(self):
+        now = time.monotonic()
+        while self._retries and self._retries[0][0] <= now:
+            _, _, recipient, attempt = heapq.heappop(self._retries)
+            self._submit(recipient, attempt)
+
+    def _submit(self, recipient, attempt):
+        origin = _push_origin(recipient)
+        espera = _breaker.espera(origin)
+        if espera > 0:
+            self._schedule(recipient, attempt, espera)
+            return
+        self._in_flight.acquire()
+        with self._lock:
+            self._pending += 1
+        self._pool_for(origin).submit(self._send, recipient, attempt)
+
+    def submit(self, recipient, attempt=0):
+        self._submit(recipient, attempt)
+        self._collect()
+        self._drain_due()
+
+    def _reschedule_pending(self):
+        """Pasa la cola de reintentos a Celery (una tarea por número de intento)."""
+        now = time.monotonic()
+        lotes = {}
+        for due, _, recipient, attempt in self._retries:
+            ids, countdown = lotes.get(attempt, ([], 0))
+            ids.append(recipient.id)
+            lotes[attempt] = (ids, max(countdown, due - now))
+        publicados = set()
+        for attempt, (ids, countdown) in lotes.items():
+            if not publicar(
+                send_webpush_retry_task,
+                args=[ids, self.payload_json, self.ttl, attempt, self.campaign_id, self.headers],
+                countdown=math.ceil(countdown),
+            ):
+                logger.info("WebPush: broker no disponible, reintentos en este proceso")
+                break
+            publicados.add(attempt)
+
+        cantidad = sum(len(lotes[attempt][0]) for attempt in publicados)
+        self.report["rescheduled"] += cantidad
+        if self.metricas is not None:
+            self.metricas.reprogramadas(cantidad)
+        self._retries = [item for item in self._retries if item[3] not in publicados]
+        heapq.heapify(self._retries)
+        return not self._retries
+
+    def close(self):
+        inline_max = getattr(settings, "WEBPUSH_RETRY_INLINE_MAX_SECONDS", 10)
+        try:
+            while True:
+                with self._idle:
+                    while self._pending:
+                        self._idle.wait()
+                self._collect()
+                self._drain_due()
+                if self._pending:
+                    continue
+                if not self._retries:
+                    break
+                wait = self._retries[0][0] - time.monotonic()
+                if wait <= 0:
+                    continue
+                if self.reprogramar and wait > inline_max and self._reschedule_pending():
+                    break
+                # Solo quedan reintentos por vencer: el envío principal ya terminó
+                time.sleep(min(wait, 1))
+        finally:
+            for pool in self._pools.values():
+                pool.shutdown(wait=True)
+            self._collect()
+            self._flush_dead()
+            if self.metricas is not None:
+                self.metricas.flush()
+        return self.report
+
+    def send_all(self, recipients):
+        try:
+            for recipient in recipients:
+                self.submit(recipient)
+        finally:
+            self.close()
+        return self.report
+
+
+def eliminar_suscripciones_muertas(subscription_ids, campaign_id=None):
+    """
+    Borra en un solo `id__in` las suscripciones 404/410 y suma la cantidad a
+    `LimpiezaSuscripcionPush` de la campaña. Retorna cuántas se borraron.
+    """
+    try:
+        _, por_modelo = SubscriptionInfo.objects.filter(id__in=set(subscription_ids)).delete()
+    except Exception:
+        logger.exception("[WebPush Error] No se pudieron borrar %s suscripciones", len(subscription_ids))
+        return 0
+
+    eliminadas = por_modelo.get(SubscriptionInfo._meta.label, 0)
+    logger.info("[WebPush] %s suscripciones muertas eliminadas (campaña %s)", eliminadas, campaign_id)
+    if campaign_id and eliminadas:
+        # Los tramos corren en paralelo: fila asegurada + UPDATE atómico
+        LimpiezaSuscripcionPush.objects.bulk_create(
+            [LimpiezaSuscripcionPush(campana=campaign_id)], ignore_conflicts=True
+        )
+        LimpiezaSuscripcionPush.objects.filter(campana=campaign_id).update(
+            eliminadas=F("eliminadas") + eliminadas,
+            actualizado_en=dj_timezone.now(),
+        )
+    return eliminadas
 
 
 def _build_report_recipients(report_email=None):
@@ -192,7 +531,7 @@ def _build_report_recipients(report_email=None):
     return list(dict.fromkeys(recipients))
 
 
-def _send_massive_report(report, report_context, report_email=None):
+def _send_massive_report(report, report_context, report_email=None, parcial=False):
     recipients = _build_report_recipients(report_email=report_email)
     if not recipients:
         logger.warning("[WebPush WARN] No hay destinatarios para el reporte de envio masivo")
@@ -204,9 +543,17 @@ def _send_massive_report(report, report_context, report_email=None):
     total = report.get("total", 1) or 1
     exito_pct = (report.get("sent", 0) / total) * 100
 
-    subject = f"[WebPush] Reporte envio masivo - Grupo {group_name}"
+    if parcial:
+        subject = f"[WebPush] Reporte parcial envio masivo - Grupo {group_name}"
+        intro = (
+            "El envio masivo de notificaciones push terminó con tramos fallidos; "
+            "las cifras son las registradas hasta el fallo.\n\n"
+        )
+    else:
+        subject = f"[WebPush] Reporte envio masivo - Grupo {group_name}"
+        intro = "Se ha completado el envio masivo de notificaciones push.\n\n"
     body = (
-        "Se ha completado el envio masivo de notificaciones push.\n\n"
+        intro +
         f"Grupo: {group_name}\n"
         f"Titulo notificacion: {notification_head}\n"
         f"URL destino: {notification_url}\n\n"
@@ -214,6 +561,7 @@ def _send_massive_report(report, report_context, report_email=None):
         f"Enviadas OK: {report.get('sent', 0)}\n"
         f"Suscripciones eliminadas (404/410): {report.get('deleted', 0)}\n"
         f"Fallidas: {report.get('failed', 0)}\n"
+        f"Reprogramadas (429/5xx): {report.get('rescheduled', 0)}\n"
         f"Porcentaje de éxito: {exito_pct:.2f}%\n"
     )
 
@@ -231,55 +579,212 @@ def _send_massive_report(report, report_context, report_email=None):
 # Envío real (síncrono) — reutilizable sin Celery
 # ************************************************************************************************
 
-def _run_send_notification_to_user(user_id, payload, ttl=0):
+def _run_send_notification_to_user(user_id, payload, ttl=0, reprogramar=False, headers=None):
     """Notificación push a un usuario (mismo proceso, sin cola)."""
     try:
         user = CustomUser.objects.get(id=user_id)
         recipients = user.webpush_info.select_related("subscription").order_by("-id")
 
-        payload_json = json.dumps(payload)
+        payload_json = _payload_json(payload)
         vapid_data = _get_vapid_data()
 
-        for recipient in recipients:
-            _dispatch_webpush(recipient, payload_json, vapid_data, ttl)
+        WebPushDispatcher(
+            payload_json, vapid_data, ttl, reprogramar=reprogramar, headers=headers
+        ).send_all(recipients)
 
     except CustomUser.DoesNotExist:
         logger.error("[WebPush] Usuario %s no encontrado", user_id)
 
 
-def _run_send_notification_to_group(group_name, payload, ttl=0, report_email=None):
-    """Notificación push masiva (mismo proceso, sin cola)."""
+def _run_send_notification_to_users(user_ids, payload, ttl=0, reprogramar=False, headers=None):
+    """Notificación push a un lote de usuarios (mismo proceso, sin cola)."""
+    recipients = (
+        PushInformation.objects
+        .filter(user_id__in=user_ids, subscription__isnull=False)
+        .select_related("subscription")
+        .order_by("id")
+    )
+
+    payload_json = _payload_json(payload)
+    vapid_data = _get_vapid_data()
+
+    WebPushDispatcher(
+        payload_json, vapid_data, ttl, reprogramar=reprogramar, headers=headers
+    ).send_all(
+        recipients.iterator(chunk_size=2000)
+    )
+
+
+def _group_recipients(group):
+    return group.webpush_info.select_related("subscription").filter(subscription__isnull=False)
+
+
+def _group_chunks(group, chunk_size):
+    """
+    Rangos de ids [(desde, hasta), ...] de `chunk_size` destinatarios cada uno,
+    calculados por keyset sobre el id de PushInformation (sin OFFSET global).
+    """
+    ids = _group_recipients(group).order_by("id").values_list("id", flat=True)
+    chunks = []
+    cursor = None
+    while True:
+        page = ids if cursor is None else ids.filter(id__gt=cursor)
+        first = page.first()
+        if first is None:
+            return chunks
+        last = list(page[chunk_size - 1:chunk_size])
+        last = last[0] if last else page.last()
+        chunks.append((first, last))
+        cursor = last
+
+
+def _merge_reports(reports):
+    merged = {"total": 0, "sent": 0, "deleted": 0, "failed": 0, "rescheduled": 0}
+    for report in reports:
+        for key in merged:
+            merged[key] += (report or {}).get(key, 0)
+    return merged
+
+
+class _CampaignMarks:
+    """
+    Destinatarios ya procesados de una campaña (`EnvioCampanaPush`), para que los
+    reintentos (del tramo o diferidos, en cualquier worker) no vuelvan a enviarles.
+    Las marcas se insertan por lotes de `WEBPUSH_CAMPAIGN_MARKS_BATCH_SIZE` y al cerrar
+    el tramo: si el worker muere, se reenvía como máximo un lote.
+    Sin `campaign_id` no hace nada.
+    """
+
+    def __init__(self, campaign_id):
+        self.campaign_id = campaign_id
+        self.batch_size = getattr(settings, "WEBPUSH_CAMPAIGN_MARKS_BATCH_SIZE", 200)
+        self._marks = []
+
+    def pendientes(self, recipients, report):
+        """Filtra los ya procesados, sumándolos a `report`."""
+        if not self.campaign_id:
+            return recipients
+        previous = dict(
+            EnvioCampanaPush.objects
+            .filter(campana=self.campaign_id, push_information_id__in=[r.id for r in recipients])
+            .values_list("push_information_id", "estado")
+        )
+        pending = []
+        for recipient in recipients:
+            status = previous.get(recipient.id)
+            if status in ("sent", "deleted"):
+                report[status] += 1
+            else:
+                pending.append(recipient)
+        return pending
+
+    def __call__(self, recipient, status):
+        if not self.campaign_id or status not in ("sent", "deleted"):
+            return
+        self._marks.append(
+            EnvioCampanaPush(campana=self.campaign_id, push_information_id=recipient.id, estado=status)
+        )
+        if len(self._marks) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        marks, self._marks = self._marks, []
+        if marks:
+            EnvioCampanaPush.objects.bulk_create(marks, ignore_conflicts=True)
+
+
+def purgar_envios_campana():
+    """Borra las marcas de envío con más de `WEBPUSH_CAMPAIGN_TTL` segundos."""
+    limite = dj_timezone.now() - timedelta(seconds=getattr(settings, "WEBPUSH_CAMPAIGN_TTL", 60 * 60 * 24))
+    borradas, _ = EnvioCampanaPush.objects.filter(creado_en__lt=limite).delete()
+    return borradas
+
+
+def _run_send_notification_chunk(
+    group_id, id_desde, id_hasta, payload, ttl=0, campaign_id=None, reprogramar=False, headers=None
+):
+    """
+    Envía a los destinatarios del grupo con id en [id_desde, id_hasta].
+    Idempotente por campaña: cada destinatario procesado queda marcado en la BD
+    con su resultado, y un reintento del mismo tramo no le vuelve a enviar.
+    """
+    recipients = list(
+        PushInformation.objects
+        .filter(group_id=group_id, id__gte=id_desde, id__lte=id_hasta, subscription__isnull=False)
+        .select_related("subscription")
+        .order_by("id")
+    )
+    report = {"total": len(recipients), "sent": 0, "deleted": 0, "failed": 0, "rescheduled": 0}
+    if not recipients:
+        return report
+
+    marks = _CampaignMarks(campaign_id)
+    recipients = marks.pendientes(recipients, report)
+    try:
+        WebPushDispatcher(
+            _payload_json(payload),
+            _get_vapid_data(),
+            ttl,
+            report=report,
+            on_result=marks,
+            reprogramar=reprogramar,
+            campaign_id=campaign_id,
+            headers=headers,
+        ).send_all(recipients)
+    finally:
+        marks.flush()
+    return report
+
+
+def _reporte_campana(campaign_id):
+    """Reporte con los contadores que los tramos ya volcaron en la `CampanaPush`."""
+    campana = CampanaPush.objects.filter(codigo=campaign_id).first() if campaign_id else None
+    if campana is None:
+        return _merge_reports([])
+    return {
+        "total": campana.total,
+        "sent": campana.enviadas,
+        "deleted": campana.eliminadas,
+        "failed": campana.fallidas,
+        "rescheduled": campana.reprogramadas,
+    }
+
+
+def _report_context(group_name, payload):
+    return {
+        "group_name": group_name,
+        "head": payload.get("head", ""),
+        "url": payload.get("url", ""),
+    }
+
+
+def _run_send_notification_to_group(
+    group_name, payload, ttl=0, report_email=None, campaign_id=None, headers=None
+):
+    """Notificación push masiva (mismo proceso, sin cola), tramo por tramo."""
     try:
         group = Group.objects.get(name=group_name)
     except (Group.DoesNotExist, Group.MultipleObjectsReturned):
         logger.warning("[WebPush WARN] Problema resolviendo el grupo '%s'", group_name)
         return
 
-    recipients_queryset = group.webpush_info.select_related("subscription").filter(
-        subscription__isnull=False
-    )
+    if campaign_id:
+        iniciar_campana(campaign_id, group_name, payload, _group_recipients(group).count())
 
-    payload_json = json.dumps(payload)
-    vapid_data = _get_vapid_data()
-
-    report = {"total": recipients_queryset.count(), "sent": 0, "deleted": 0, "failed": 0}
-
-    for recipient in recipients_queryset.iterator(chunk_size=2000):
-        status = _dispatch_webpush(recipient, payload_json, vapid_data, ttl)
-        if status == "sent":
-            report["sent"] += 1
-        elif status == "deleted":
-            report["deleted"] += 1
-        else:
-            report["failed"] += 1
+    chunk_size = getattr(settings, "WEBPUSH_CHUNK_SIZE", 2000)
+    report = _merge_reports(
+        _run_send_notification_chunk(
+            group.id, desde, hasta, payload, ttl, campaign_id, headers=headers
+        )
+        for desde, hasta in _group_chunks(group, chunk_size)
+    )
+    if campaign_id:
+        finalizar_campana(campaign_id)
+        purgar_envios_campana()
 
     _send_massive_report(
         report=report,
-        report_context={
-            "group_name": group_name,
-            "head": payload.get("head", ""),
-            "url": payload.get("url", ""),
-        },
+        report_context=_report_context(group_name, payload),
         report_email=report_email,
     )
 
@@ -289,15 +794,121 @@ def _run_send_notification_to_group(group_name, payload, ttl=0, report_email=Non
 # ************************************************************************************************
 
 @shared_task
-def send_notification_to_user_task(user_id, payload, ttl=0):
+def send_notification_to_user_task(user_id, payload, ttl=0, headers=None):
     """Tarea asíncrona para notificar a un solo usuario."""
-    _run_send_notification_to_user(user_id, payload, ttl)
+    _run_send_notification_to_user(user_id, payload, ttl, reprogramar=True, headers=headers)
+
+
+@shared_task
+def send_notification_to_users_task(user_ids, payload, ttl=0, headers=None):
+    """Tarea asíncrona para notificar a un lote de usuarios."""
+    _run_send_notification_to_users(user_ids, payload, ttl, reprogramar=True, headers=headers)
+
+
+@shared_task(acks_late=True, autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def send_notification_chunk_task(
+    group_id, id_desde, id_hasta, payload, ttl=0, campaign_id=None, headers=None
+):
+    """Un tramo de destinatarios de un envío masivo; se puede reintentar sin reenviar."""
+    return _run_send_notification_chunk(
+        group_id, id_desde, id_hasta, payload, ttl, campaign_id, reprogramar=True, headers=headers
+    )
+
+
+@shared_task(acks_late=True)
+def send_webpush_retry_task(push_ids, payload_json, ttl=0, attempt=1, campaign_id=None, headers=None):
+    """Reintento diferido (429/5xx) de envíos push, programado con `countdown`."""
+    recipients = list(
+        PushInformation.objects
+        .filter(id__in=push_ids, subscription__isnull=False)
+        .select_related("subscription")
+        .order_by("id")
+    )
+    marks = _CampaignMarks(campaign_id)
+    dispatcher = WebPushDispatcher(
+        payload_json,
+        _get_vapid_data(),
+        ttl,
+        on_result=marks,
+        reprogramar=True,
+        campaign_id=campaign_id,
+        headers=headers,
+    )
+    try:
+        for recipient in marks.pendientes(recipients, dispatcher.report):
+            dispatcher.submit(recipient, attempt)
+    finally:
+        dispatcher.close()
+        marks.flush()
+    return dispatcher.report
+
+
+@shared_task
+def send_group_report_task(reports, group_name, payload, report_email=None, campaign_id=None):
+    """Callback del chord: suma los tramos, cierra la campaña y envía un solo reporte."""
+    if campaign_id:
+        finalizar_campana(campaign_id)
+        purgar_envios_campana()
+    _send_massive_report(
+        report=_merge_reports(reports),
+        report_context=_report_context(group_name, payload),
+        report_email=report_email,
+    )
+
+
+@shared_task
+def send_group_report_error_task(request, exc, traceback, group_name, payload, report_email=None, campaign_id=None):
+    """
+    Errback del chord: algún tramo agotó sus reintentos y el callback no se ejecuta.
+    Cierra la campaña y envía un reporte parcial con las métricas de `CampanaPush`.
+    """
+    logger.error("[WebPush ERROR] Envío masivo al grupo '%s' con tramos fallidos: %s", group_name, exc)
+    if campaign_id:
+        finalizar_campana(campaign_id)
+        purgar_envios_campana()
+    _send_massive_report(
+        report=_reporte_campana(campaign_id),
+        report_context=_report_context(group_name, payload),
+        report_email=report_email,
+        parcial=True,
+    )
 
 
 @shared_task
-def send_notification_to_group_task(group_name, payload, ttl=0, report_email=None):
-    """Tarea asíncrona masiva optimizada para miles de registros."""
-    _run_send_notification_to_group(group_name, payload, ttl, report_email)
+def send_notification_to_group_task(
+    group_name, payload, ttl=0, report_email=None, campaign_id=None, headers=None
+):
+    """
+    Tarea asíncrona masiva: divide el grupo en tramos por id y los reparte entre
+    los workers como un chord; el callback envía el reporte consolidado.
+    """
+    campaign_id = campaign_id or uuid.uuid4().hex
+    try:
+        group = Group.objects.get(name=group_name)
+    except (Group.DoesNotExist, Group.MultipleObjectsReturned):
+        logger.warning("[WebPush WARN] Problema resolviendo el grupo '%s'", group_name)
+        return
+
+    chunks = _group_chunks(group, getattr(settings, "WEBPUSH_CHUNK_SIZE", 2000))
+    if len(chunks) <= 1 or not broker_disponible():
+        _run_send_notification_to_group(group_name, payload, ttl, report_email, campaign_id, headers)
+        return
+
+    iniciar_campana(campaign_id, group_name, payload, _group_recipients(group).count())
+    header = [
+        send_notification_chunk_task.s(group.id, desde, hasta, payload, ttl, campaign_id, headers)
+        for desde, hasta in chunks
+    ]
+    try:
+        callback = send_group_report_task.s(group_name, payload, report_email, campaign_id).on_error(
+            send_group_report_error_task.s(group_name, payload, report_email, campaign_id)
+        )
+        chord(header)(callback)
+    except Exception as exc:
+        # Sin result backend (o sin broker) no hay chord: se procesa aquí mismo
+        # (idempotente por campaña, los tramos ya publicados no se reenvían)
+        logger.warning("[WebPush WARN] No se pudo lanzar el chord (%s); envío por tramos en esta tarea", exc)
+        _run_send_notification_to_group(group_name, payload, ttl, report_email, campaign_id, headers)
 
 
 # ************************************************************************************************
@@ -305,25 +916,42 @@ def send_notification_to_group_task(group_name, payload, ttl=0, report_email=Non
 # ************************************************************************************************
 
 
-def send_notification_to_user(user, payload, ttl=0):
+def send_notification_to_user(user, payload, ttl=None, topic=None, urgency=None):
     """
-    Encola con Celery si el broker responde; si no, envía en el mismo proceso.
-    Nada que configurar en settings por proyecto.
+    Registra el envío en el outbox: se encola con Celery tras el commit de la
+    transacción actual y no se envía si ésta se revierte (ver core/outbox.py). Sin
+    broker, el envío se hace en segundo plano en este proceso (ver core/tareas.py).
+
+    - `ttl`: segundos que el servicio push guarda el mensaje si el dispositivo está
+      desconectado (None: `settings.WEBPUSH_DEFAULT_TTL`, 0 por defecto).
+    - `topic`: los mensajes pendientes con el mismo topic se reemplazan (requiere ttl > 0
+      para tener efecto), p.ej. 'aviso-masivo'.
+    - `urgency`: 'very-low', 'low', 'normal' o 'high'.
     """
     uid = user.id
-    try:
-        send_notification_to_user_task.delay(uid, payload, ttl)
-    except Exception as exc:
-        logger.info(
-            "WebPush: cola no disponible, envio sincrono (usuario %s): %s",
-            uid, exc
-        )
-        _run_send_notification_to_user(uid, payload, ttl)
+    ttl = _resolve_ttl(ttl)
+    headers = _push_headers(topic, urgency)
+    registrar(send_notification_to_user_task, uid, payload, ttl, headers)
+
+
+def send_notification_to_users(user_ids, payload, ttl=None, topic=None, urgency=None):
+    """
+    Igual que `send_notification_to_user` pero para un lote de ids de usuario:
+    una sola tarea en la cola para todo el lote.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    ttl = _resolve_ttl(ttl)
+    headers = _push_headers(topic, urgency)
+    registrar(send_notification_to_users_task, user_ids, payload, ttl, headers)
 
 
-def send_notification_to_group(group_name, payload, ttl=0, report_email=None):
+def send_notification_to_group(group_name, payload, ttl=None, report_email=None, topic=None, urgency=None):
     """
-    Misma lógica que `send_notification_to_user`: prueba cola, si falla, envío sincrono.
+    Misma lógica que `send_notification_to_user` (incluidos `ttl`, `topic` y `urgency`):
+    outbox y cola de Celery tras el commit o, sin broker, segundo plano en este proceso.
+    Retorna la `CampanaPush` creada para seguir el progreso, o False si no se envía.
     """
     try:
         group = Group.objects.get(name=group_name)
@@ -341,28 +969,37 @@ def send_notification_to_group(group_name, payload, ttl=0, report_email=None):
         logger.warning("[WebPush WARN] El grupo '%s' no tiene suscripciones activas", group_name)
         return False
 
-    try:
-        send_notification_to_group_task.delay(
-            group_name, payload, ttl, report_email
-        )
-    except Exception as exc:
-        logger.info(
-            "WebPush: cola no disponible, envio sincrono (grupo %s): %s",
-            group_name, exc
-        )
-        _run_send_notification_to_group(
-            group_name, payload, ttl, report_email
-        )
-    return True
+    ttl = _resolve_ttl(ttl)
+    headers = _push_headers(topic, urgency)
+    campaign_id = uuid.uuid4().hex
+    campana = registrar_campana(campaign_id, group_name, payload)
+    registrar(send_notification_to_group_task, group_name, payload, ttl, report_email, campaign_id, headers)
+    return campana
+
+
+TIPO_NOTIFICACION_CACHE_KEY = "core:tipo_notificacion:{}"
+
+
+def get_tipo_notificacion(tipo):
+    """TipoNotificacion por nombre, cacheado (se invalida en signals.py). None si no existe."""
+    from .models import TipoNotificacion
+
+    key = TIPO_NOTIFICACION_CACHE_KEY.format(tipo)
+    tipo_notificacion = cache.get(key)
+    if tipo_notificacion is None:
+        tipo_notificacion = TipoNotificacion.objects.filter(tipo=tipo).first()
+        if tipo_notificacion is not None:
+            cache.set(key, tipo_notificacion, 60 * 60)
+    return tipo_notificacion
 
 
 def notify_user(usuario_notificado, usuario_notifica, url, mensaje="", tipo='agradecimiento_solucion'):
     """Crea una notificación para un usuario en la aplicación."""
-    from .models import NotificacionUsuario, NotificacionUsuarioCount, TipoNotificacion
+    from .models import NotificacionUsuario
+    from .contador_notificaciones import incrementar_contadores
 
-    try:
-        tipo_notificacion = TipoNotificacion.objects.get(tipo=tipo)
-    except TipoNotificacion.DoesNotExist:
+    tipo_notificacion = get_tipo_notificacion(tipo)
+    if tipo_notificacion is None:
         logger.warning("Tipo de notificación no existe: %s", tipo)
         return
 
@@ -375,44 +1012,91 @@ def notify_user(usuario_notificado, usuario_notifica, url, mensaje="", tipo='agr
             mensaje=mensaje,
         )
 
-        numero_noti, _ = NotificacionUsuarioCount.objects.get_or_create(
-            usuario=usuario_notificado
-        )
-        numero_noti.numero = numero_noti.numero + 1
-        numero_noti.save()
+        incrementar_contadores([usuario_notificado.pk])
         return notificacion
     except Exception:
         logger.exception("Error creando notificación en la app")
         return
 
 
-def notify_push_app_user(usuario_notificado, usuario_notifica, url, mensaje="", tipo='agradecimiento_solucion'):
-    """Notifica en la app y encola notificación webpush al usuario."""
-    from .models import AplicacionWeb
+def notify_users(usuarios_notificados, usuario_notifica, url, mensaje="", tipo='agradecimiento_solucion',
+                 push=False, batch_size=1000):
+    """
+    Versión masiva de `notify_user`: crea las notificaciones con bulk_create por lotes
+    y actualiza los contadores de cada lote con una sola operación.
+    `usuarios_notificados` acepta usuarios o ids. Con `push=True` encola además
+    el Web Push de todo el lote en una sola tarea. Retorna cuántas notificaciones creó.
+    """
+    from .models import NotificacionUsuario
+    from .contador_notificaciones import incrementar_contadores
 
+    tipo_notificacion = get_tipo_notificacion(tipo)
+    if tipo_notificacion is None:
+        logger.warning("Tipo de notificación no existe: %s", tipo)
+        return 0
+
+    user_ids = list(dict.fromkeys(getattr(u, "pk", u) for u in usuarios_notificados))
+    creadas = 0
     try:
-        app = AplicacionWeb.objects.first()
-        logo_url = app.logo.url if app and app.logo else ""
-        url_base = settings.URL_BASE
+        for inicio in range(0, len(user_ids), batch_size):
+            lote = user_ids[inicio:inicio + batch_size]
+            with transaction.atomic():
+                NotificacionUsuario.objects.bulk_create(
+                    [
+                        NotificacionUsuario(
+                            usuario_notificado_id=user_id,
+                            usuario_notifica=usuario_notifica,
+                            tipo=tipo_notificacion,
+                            url=url,
+                            mensaje=mensaje,
+                        )
+                        for user_id in lote
+                    ],
+                    batch_size=batch_size,
+                )
+                incrementar_contadores(lote)
+            creadas += len(lote)
+    except Exception:
+        logger.exception("Error creando notificaciones masivas en la app")
+        return creadas
 
-        notificacion = notify_user(
-            usuario_notificado=usuario_notificado,
-            usuario_notifica=usuario_notifica,
-            tipo=tipo,
-            url=url,
-            mensaje=mensaje,
-        )
-        if not notificacion:
-            return
+    if push and user_ids:
+        from .cache_sitio import get_aplicacion_web
 
+        app = get_aplicacion_web()
+        logo_url = app.logo.url if app and app.logo else ""
+        notificacion = NotificacionUsuario(
+            usuario_notifica=usuario_notifica, tipo=tipo_notificacion, url=url, mensaje=mensaje,
+        )
         payload = {
             "head": notificacion.titulo(),
             "body": notificacion.mensaje_final(),
-            "icon": f"{url_base}{logo_url}",
+            "icon": f"{settings.URL_BASE}{logo_url}",
             "url": url,
         }
+        send_notification_to_users(user_ids, payload)
+    return creadas
+
+
+def notify_push_app_user(usuario_notificado, usuario_notifica, url, mensaje="", tipo='agradecimiento_solucion'):
+    """
+    Notifica en la app y encola notificación webpush al usuario, según sus preferencias
+    (`UserNotificationSetting`): no se crea ni se envía lo que el usuario desactivó.
+    """
+    from .preferencias_notificacion import CANAL_INTERNA, CANAL_PUSH, notificar_usuarios
 
-        send_notification_to_user(usuario_notificado, payload)
+    try:
+        # Notificaciones repetidas del mismo tipo y url se reemplazan en el servicio push
+        notificar_usuarios(
+            [usuario_notificado],
+            usuario_notifica,
+            url,
+            mensaje=mensaje,
+            tipo=tipo,
+            canales=(CANAL_INTERNA, CANAL_PUSH),
+            ttl=getattr(settings, "WEBPUSH_NOTIFICACION_TTL", 60 * 60 * 24),
+            topic=f"{tipo}:{url}",
+        )
     except Exception:
         logger.exception("Error al enviar notificación push app")
-        return
\ No newline at end of file
+        return
@@ -0,0 +1,178 @@
+"""
+Outbox transaccional para las tareas de notificaciones, correos y WhatsApp.
+
+`registrar(task, *args)` no publica nada: inserta una fila `OutboxMensaje` en la
+transacción en curso. Si la transacción se revierte la fila desaparece con ella y no
+se envía nada. Tras el commit (`transaction.on_commit`) se encola una sola tarea
+`relay_outbox_task` con los ids de todo el request, y es el relay, fuera del hilo del
+request, quien entrega cada fila a Celery. Si el broker está caído el relay espera en la
+cola local acotada de core/tareas.py, que lo publica cuando el broker vuelve (o lo
+ejecuta tras `TAREAS_COLA_LOCAL_ESPERA`); sin Celery configurado se ejecuta de
+inmediato en el hilo de esa cola.
+
+Entrega al menos una vez: el relay toma las filas con SELECT ... FOR UPDATE (SKIP
+LOCKED si la BD lo soporta), así dos relays no toman la misma fila a la vez, y marca
+como enviadas las publicadas en la misma transacción. La publicación ocurre antes del
+commit: si ese commit falla, la fila se vuelve a publicar más tarde (el `task_id`
+`outbox-<id>` sirve para identificar duplicados, Celery no los descarta). Las tareas
+deben tolerar una entrega repetida.
+
+Si el broker no responde, las filas tomadas se ejecutan en el proceso del relay (ver
+core/tareas.py), fuera de la transacción, y solo se marcan si la tarea terminó sin
+error; las que fallan quedan pendientes.
+
+Las filas pendientes (el proceso murió tras el commit, una ejecución local falló) las
+recoge `relay_outbox_task` sin argumentos, que se agrega a Celery beat al arrancar
+(cada `OUTBOX_BEAT_INTERVALO` segundos; None para programarlo a mano). Sin Celery no
+hay beat: llamar `relay_outbox_task()` periódicamente (p.ej. cron).
+
+Settings (opcionales):
+    OUTBOX_LOTE = 500
+    OUTBOX_RELAY_GRACIA = 60
+    OUTBOX_RETENCION_DIAS = 7
+    OUTBOX_BEAT_INTERVALO = 60
+"""
+import importlib
+import logging
+import threading
+from datetime import timedelta
+
+from celery import current_app, shared_task
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import OutboxMensaje
+from .tareas import _ejecutar_local, encolar, publicar
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _pendientes():
+    if not hasattr(_local, "ids"):
+        _local.ids = []
+    return _local.ids
+
+
+def registrar(task, *args, **kwargs):
+    """
+    Registra `task(*args, **kwargs)` para ejecutarse después del commit de la
+    transacción actual (de inmediato si no hay transacción). Los argumentos deben ser
+    serializables a JSON. Retorna la fila creada.
+    """
+    mensaje = OutboxMensaje.objects.create(tarea=task.name, args=list(args), kwargs=kwargs)
+    _pendientes().append(mensaje.pk)
+    # Se registra en cada llamada: el primer callback entrega todo el lote y los demás
+    # no encuentran nada. Los ids de una transacción revertida ya no existen en la BD.
+    transaction.on_commit(_entregar_pendientes)
+    return mensaje
+
+
+def _entregar_pendientes():
+    # Puede arrastrar ids de una transacción revertida: el relay solo toma filas
+    # confirmadas y sin entregar, así que no hay doble entrega.
+    ids, _local.ids = list(dict.fromkeys(_pendientes())), []
+    if not ids:
+        return
+    # Sin broker el relay pasa a la cola local acotada de core/tareas.py, que lo reenvía
+    # a Celery cuando el broker vuelve (o lo ejecuta ahí mismo si no hay Celery)
+    if not encolar(relay_outbox_task, ids):
+        logger.info("Outbox: broker no disponible, relay en la cola local (%s mensajes)", len(ids))
+
+
+def _tarea(nombre):
+    task = current_app.tasks.get(nombre)
+    if task is None:
+        # El worker puede no haber importado el módulo que registró la tarea
+        modulo = nombre.rsplit(".", 1)[0]
+        try:
+            importlib.import_module(modulo)
+        except ImportError:
+            logger.warning("Outbox: no se pudo importar %s", modulo)
+        task = current_app.tasks.get(nombre)
+    return task
+
+
+def _tomar_lote(queryset, lote):
+    if connection.features.has_select_for_update_skip_locked:
+        queryset = queryset.select_for_update(skip_locked=True)
+    else:
+        queryset = queryset.select_for_update()
+    return list(queryset.order_by("id")[:lote])
+
+
+def relay_outbox(ids=None, antes_de=None, lote=None):
+    """
+    Entrega a Celery las filas pendientes (`ids`, o todas las creadas antes de
+    `antes_de`) en lotes de `OUTBOX_LOTE`. Retorna cuántas filas entregó.
+    """
+    lote = lote or getattr(settings, "OUTBOX_LOTE", 500)
+    pendientes = OutboxMensaje.objects.filter(enviado_en__isnull=True)
+    if ids is not None:
+        pendientes = pendientes.filter(pk__in=ids)
+    if antes_de is not None:
+        pendientes = pendientes.filter(creado_en__lt=antes_de)
+
+    total = 0
+    ultimo_id = 0
+    while True:
+        locales = []
+        entregados = []
+        with transaction.atomic():
+            # Por id creciente: una fila que falló en la ejecución local no se repite
+            mensajes = _tomar_lote(pendientes.filter(pk__gt=ultimo_id), lote)
+            if not mensajes:
+                return total
+            ultimo_id = mensajes[-1].pk
+            for mensaje in mensajes:
+                task = _tarea(mensaje.tarea)
+                if task is None:
+                    logger.error("Outbox: tarea desconocida %s (#%s), se descarta", mensaje.tarea, mensaje.pk)
+                    entregados.append(mensaje.pk)
+                elif publicar(task, mensaje.args, mensaje.kwargs, task_id=f"outbox-{mensaje.pk}"):
+                    entregados.append(mensaje.pk)
+                else:
+                    locales.append((task, mensaje))
+            OutboxMensaje.objects.filter(pk__in=entregados).update(enviado_en=timezone.now())
+        # Fuera de la transacción, para no retener los locks mientras se envía. Solo se
+        # marcan las que terminaron bien; las demás las reintenta el relay periódico.
+        ejecutados = [m.pk for task, m in locales if _ejecutar_local(task, m.args, m.kwargs)]
+        if ejecutados:
+            OutboxMensaje.objects.filter(pk__in=ejecutados).update(enviado_en=timezone.now())
+        total += len(entregados) + len(ejecutados)
+
+
+def purgar_outbox(dias=None):
+    """Elimina las filas entregadas hace más de `OUTBOX_RETENCION_DIAS` días."""
+    dias = getattr(settings, "OUTBOX_RETENCION_DIAS", 7) if dias is None else dias
+    limite = timezone.now() - timedelta(days=dias)
+    borradas, _ = OutboxMensaje.objects.filter(enviado_en__lt=limite).delete()
+    return borradas
+
+
+@shared_task
+def relay_outbox_task(ids=None):
+    """
+    Con `ids`: entrega el lote de un request. Sin `ids` (Celery beat): entrega las filas
+    olvidadas hace más de `OUTBOX_RELAY_GRACIA` segundos y purga las antiguas.
+    """
+    if ids is not None:
+        return relay_outbox(ids=ids)
+    gracia = getattr(settings, "OUTBOX_RELAY_GRACIA", 60)
+    entregadas = relay_outbox(antes_de=timezone.now() - timedelta(seconds=gracia))
+    purgar_outbox()
+    return entregadas
+
+
+def programar_relay(scheduler):
+    """Agrega `relay_outbox_task` a `scheduler` de Celery beat si no está programado."""
+    intervalo = getattr(settings, "OUTBOX_BEAT_INTERVALO", 60)
+    if not intervalo:
+        return
+    if any(entrada.task == relay_outbox_task.name for entrada in scheduler.schedule.values()):
+        return
+    scheduler.update_from_dict({
+        "core-relay-outbox": {"task": relay_outbox_task.name, "schedule": float(intervalo)},
+    })
@@ -0,0 +1,241 @@
+"""
+Paginación por keyset (seek) para listados grandes.
+
+En lugar de `OFFSET n` + `COUNT(*)`, cada página se pide con un cursor que contiene los
+valores del `ordering` (más la pk como desempate) de la última / primera fila mostrada:
+`WHERE (orden, pk) > (cursor) ORDER BY orden, pk LIMIT n + 1`. El costo no depende de
+la página y usa los índices del orden.
+
+Solo se admiten campos NOT NULL de un solo valor: la comparación `>` con NULL no
+incluye esas filas y cada BD las ordena en un extremo distinto. Las FK se comparan y
+ordenan por su columna (`<fk>_id`), no por el `Meta.ordering` del modelo relacionado.
+Con otro `ordering`, `admite_keyset` es False y la vista usa el `Paginator`.
+
+El total es opcional: exacto (`COUNT(*)`), estimado (en PostgreSQL con `reltuples` o
+el plan de EXPLAIN; en otras BD se cuenta) o ninguno.
+"""
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+
+PARAM_DESPUES = "despues"
+PARAM_ANTES = "antes"
+
+CONTEO_EXACTO = "exact"
+CONTEO_ESTIMADO = "estimated"
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder recorta los microsegundos; el cursor necesita el valor exacto."""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _codificar(valores):
+    data = json.dumps(valores, cls=_CursorEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def _decodificar(cursor):
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+    except (ValueError, TypeError):
+        return None
+    return valores if isinstance(valores, list) else None
+
+
+def _campo_orden(model, campo):
+    """
+    (campo, field) para comparar y ordenar por `campo` ('relacion__campo'); una FK final
+    pasa a su columna (`relacion_id`). ValueError si el path admite NULL, es
+    multivaluado o no es un campo.
+    """
+    partes = campo.split("__")
+    field = None
+    for i, parte in enumerate(partes):
+        try:
+            field = model._meta.pk if parte == "pk" else model._meta.get_field(parte)
+        except FieldDoesNotExist:
+            raise ValueError(f"'{campo}' no es un campo de {model.__name__}")
+        if not field.concrete or field.many_to_many:
+            raise ValueError(f"'{campo}' atraviesa una relación multivaluada o inversa")
+        if field.null:
+            raise ValueError(f"'{campo}' admite NULL")
+        if i < len(partes) - 1:
+            if not field.is_relation:
+                raise ValueError(f"'{campo}' no es un campo de {model.__name__}")
+            model = field.related_model
+    if field.is_relation and partes[-1] != "pk":
+        partes[-1] = field.attname
+    return "__".join(partes), field
+
+
+def orden_keyset(ordering, model):
+    """
+    [(campo, descendente, field)] para `ordering` de `model`, con la pk al final como
+    desempate (en la dirección del último campo). Solo admite nombres de campo NOT NULL
+    de un solo valor; ValueError en otro caso.
+    """
+    orden = []
+    for item in ordering or ():
+        if not isinstance(item, str) or item == "?":
+            raise ValueError("La paginación keyset solo admite `ordering` con nombres de campo")
+        desc = item.startswith("-")
+        campo = item.lstrip("-+")
+        campo, field = _campo_orden(model, "pk" if campo == "id" else campo)
+        orden.append((campo, desc, field))
+    if not any(campo == "pk" for campo, _, _ in orden):
+        orden.append(("pk", orden[-1][1] if orden else True, model._meta.pk))
+    return orden
+
+
+def admite_keyset(model, ordering):
+    """True si `ordering` de `model` se puede paginar por keyset (ver `orden_keyset`)."""
+    try:
+        orden_keyset(ordering, model)
+    except ValueError:
+        return False
+    return True
+
+
+def _convertir(orden, valores):
+    """Valores del cursor con el tipo de cada campo, o None si no corresponden a `orden`."""
+    if not valores or len(valores) != len(orden):
+        return None
+    try:
+        convertidos = [field.to_python(valor) for (_, _, field), valor in zip(orden, valores)]
+    except (ValidationError, TypeError, ValueError):
+        return None
+    if any(valor is None for valor in convertidos):
+        return None
+    return convertidos
+
+
+def _valor(obj, campo):
+    for parte in campo.split("__"):
+        obj = getattr(obj, parte, None)
+        if obj is None:
+            return None
+    # Relaciones: se compara por la pk del objeto relacionado
+    return getattr(obj, "pk", obj)
+
+
+def _filtro_despues(orden, valores, invertir=False):
+    """Q de las filas posteriores a `valores` en `orden` (anteriores si `invertir`)."""
+    condicion = Q()
+    iguales = Q()
+    for (campo, desc, _), valor in zip(orden, valores):
+        mayor = desc == invertir
+        condicion |= iguales & Q(**{f"{campo}__{'gt' if mayor else 'lt'}": valor})
+        iguales &= Q(**{campo: valor})
+    return condicion
+
+
+def _order_by(orden, invertir=False):
+    return [f"{'-' if desc != invertir else ''}{campo}" for campo, desc, _ in orden]
+
+
+class KeysetPage:
+    """Página con la interfaz que usan las plantillas (`has_next`, `has_previous`...)."""
+    is_keyset = True
+
+    def __init__(self, object_list, orden, has_next, has_previous, count=None, count_estimado=False):
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+        self.count = count
+        self.count_estimado = count_estimado
+        self.next_cursor = _codificar([_valor(object_list[-1], c) for c, _, _ in orden]) if object_list else None
+        self.previous_cursor = _codificar([_valor(object_list[0], c) for c, _, _ in orden]) if object_list else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+
+def estimar_total(queryset):
+    """
+    Total aproximado sin `COUNT(*)`: en PostgreSQL `reltuples` de la tabla (sin filtros)
+    o las filas estimadas por EXPLAIN; en otras bases de datos, el conteo exacto.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return queryset.count(), False
+
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            fila = cursor.fetchone()
+            # -1 / 0: tabla sin ANALYZE todavía
+            if fila and fila[0] > 0:
+                return int(fila[0]), True
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"]), True
+
+
+def paginar_keyset(queryset, ordering, per_page, despues=None, antes=None, conteo=None):
+    """
+    Página de `per_page` filas de `queryset` ordenado por `ordering` + pk.
+    `despues` / `antes`: cursores recibidos en la querystring (None: primera página).
+    `conteo`: 'exact', 'estimated' o None (sin total).
+    """
+    orden = orden_keyset(ordering, queryset.model)
+    # Un cursor de otro `ordering` (o manipulado) vuelve a la primera página
+    valores_despues = _convertir(orden, _decodificar(despues)) if despues else None
+    valores_antes = _convertir(orden, _decodificar(antes)) if antes and not valores_despues else None
+
+    if valores_antes:
+        filas = list(
+            queryset.filter(_filtro_despues(orden, valores_antes, invertir=True))
+            .order_by(*_order_by(orden, invertir=True))[:per_page + 1]
+        )
+        has_previous = len(filas) > per_page
+        object_list = filas[:per_page][::-1]
+        has_next = True
+    else:
+        if valores_despues:
+            queryset_pagina = queryset.filter(_filtro_despues(orden, valores_despues))
+        else:
+            queryset_pagina = queryset
+        filas = list(queryset_pagina.order_by(*_order_by(orden))[:per_page + 1])
+        has_next = len(filas) > per_page
+        object_list = filas[:per_page]
+        has_previous = bool(valores_despues)
+
+    count, estimado = None, False
+    if conteo == CONTEO_ESTIMADO:
+        count, estimado = estimar_total(queryset)
+    elif conteo == CONTEO_EXACTO:
+        count = queryset.count()
+
+    return KeysetPage(object_list, orden, has_next, has_previous, count, estimado)
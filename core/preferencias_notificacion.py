@@ -0,0 +1,161 @@
+"""
+Enrutado de notificaciones por canal según `UserNotificationSetting`.
+
+`notificar_usuarios(...)` carga las preferencias de todos los destinatarios de una vez
+(cache por usuario + una sola consulta para los que faltan), separa los ids por canal y
+entrega cada canal a su envío por lotes: notificaciones internas con `notify_users`,
+Web Push con `send_notification_to_users` y correo con `send_emails_thread`. A quien
+desactivó un canal no se le genera trabajo en ese canal.
+
+Los usuarios sin `UserNotificationSetting` reciben todos los canales (los defaults del
+modelo). El cache se invalida en signals.py al guardar o borrar una preferencia.
+
+Settings (opcionales):
+    NOTIFICACION_PREFERENCIAS_TTL = 3600
+"""
+import logging
+
+from allauth.account.models import EmailAddress
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import CustomUser, UserNotificationSetting
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'core:noti_pref'
+
+CANAL_INTERNA = 'interna'
+CANAL_PUSH = 'push'
+CANAL_EMAIL = 'email'
+CANALES = (CANAL_INTERNA, CANAL_PUSH, CANAL_EMAIL)
+
+_CAMPOS = {
+    CANAL_EMAIL: 'notificacion_email',
+    CANAL_INTERNA: 'notificacion_interna',
+    CANAL_PUSH: 'notificacion_push',
+}
+_POR_DEFECTO = tuple(UserNotificationSetting._meta.get_field(_CAMPOS[c]).default for c in CANALES)
+
+
+def _key(usuario_id):
+    return f'{CACHE_PREFIX}:{usuario_id}'
+
+
+def preferencias_usuarios(usuario_ids):
+    """{usuario_id: (interna, push, email)} con una consulta como máximo."""
+    usuario_ids = list(dict.fromkeys(usuario_ids))
+    cacheadas = cache.get_many([_key(uid) for uid in usuario_ids])
+    preferencias = {
+        uid: tuple(cacheadas[_key(uid)]) for uid in usuario_ids if _key(uid) in cacheadas
+    }
+    faltantes = [uid for uid in usuario_ids if uid not in preferencias]
+    if faltantes:
+        cargadas = dict.fromkeys(faltantes, _POR_DEFECTO)
+        filas = UserNotificationSetting.objects.filter(user_id__in=faltantes).values_list(
+            'user_id', *(_CAMPOS[c] for c in CANALES)
+        )
+        for user_id, *valores in filas:
+            cargadas[user_id] = tuple(valores)
+        cache.set_many(
+            {_key(uid): valores for uid, valores in cargadas.items()},
+            getattr(settings, 'NOTIFICACION_PREFERENCIAS_TTL', 60 * 60),
+        )
+        preferencias.update(cargadas)
+    return preferencias
+
+
+def invalidar_preferencias(usuario_id):
+    transaction.on_commit(lambda: cache.delete(_key(usuario_id)))
+
+
+def destinatarios_por_canal(usuario_ids, canales=CANALES):
+    """{canal: [ids]} con los usuarios que tienen activo cada canal de `canales`."""
+    preferencias = preferencias_usuarios(usuario_ids)
+    por_canal = {canal: [] for canal in canales}
+    for uid, valores in preferencias.items():
+        activos = dict(zip(CANALES, valores))
+        for canal in canales:
+            if activos[canal]:
+                por_canal[canal].append(uid)
+    return por_canal
+
+
+def emails_usuarios(usuario_ids):
+    """
+    {usuario_id: email} con el mismo criterio que `CustomUser.mi_email()` (verificado,
+    luego `email`, luego cualquiera) en tres consultas para todo el lote.
+    """
+    emails = {}
+    for user_id, email in EmailAddress.objects.filter(
+        user_id__in=usuario_ids, verified=True
+    ).values_list('user_id', 'email'):
+        emails.setdefault(user_id, email)
+    for user_id, email in CustomUser.objects.filter(pk__in=usuario_ids).values_list('pk', 'email'):
+        if email:
+            emails.setdefault(user_id, email)
+    faltantes = [uid for uid in usuario_ids if uid not in emails]
+    if faltantes:
+        for user_id, email in EmailAddress.objects.filter(user_id__in=faltantes).values_list('user_id', 'email'):
+            emails.setdefault(user_id, email)
+    return emails
+
+
+def notificar_usuarios(usuarios, usuario_notifica, url, mensaje="", tipo='agradecimiento_solucion',
+                       canales=CANALES, ttl=None, topic=None):
+    """
+    Notifica a `usuarios` (usuarios o ids) por los `canales` que cada uno tenga activos.
+    Retorna {canal: cantidad de destinatarios}.
+    """
+    from django.template.loader import render_to_string
+
+    from .cache_sitio import get_aplicacion_web
+    from .correos import send_emails_thread
+    from .models import NotificacionUsuario
+    from .notificaciones import get_tipo_notificacion, notify_users, send_notification_to_users
+
+    tipo_notificacion = get_tipo_notificacion(tipo)
+    if tipo_notificacion is None:
+        logger.warning("Tipo de notificación no existe: %s", tipo)
+        return {canal: 0 for canal in canales}
+
+    usuario_ids = [getattr(u, 'pk', u) for u in usuarios]
+    por_canal = destinatarios_por_canal(usuario_ids, canales)
+    resultado = {canal: len(ids) for canal, ids in por_canal.items()}
+
+    if por_canal.get(CANAL_INTERNA):
+        notify_users(por_canal[CANAL_INTERNA], usuario_notifica, url, mensaje=mensaje, tipo=tipo)
+
+    if not por_canal.get(CANAL_PUSH) and not por_canal.get(CANAL_EMAIL):
+        return resultado
+
+    notificacion = NotificacionUsuario(
+        usuario_notifica=usuario_notifica, tipo=tipo_notificacion, url=url, mensaje=mensaje,
+    )
+    titulo, cuerpo = notificacion.titulo(), notificacion.mensaje_final()
+
+    if por_canal.get(CANAL_PUSH):
+        app = get_aplicacion_web()
+        logo_url = app.logo.url if app and app.logo else ""
+        payload = {
+            "head": titulo,
+            "body": cuerpo,
+            "icon": f"{settings.URL_BASE}{logo_url}",
+            "url": url,
+        }
+        send_notification_to_users(por_canal[CANAL_PUSH], payload, ttl=ttl, topic=topic)
+
+    if por_canal.get(CANAL_EMAIL):
+        emails = emails_usuarios(por_canal[CANAL_EMAIL])
+        resultado[CANAL_EMAIL] = len(emails)
+        if emails:
+            body = render_to_string('correo/base_correo.html', {
+                'title': titulo,
+                'message': cuerpo,
+                'button_text': "Ver notificación",
+                'button_url': f"{settings.URL_BASE}{url}",
+            })
+            send_emails_thread(titulo, body, list(emails.values()))
+
+    return resultado
@@ -1,10 +1,20 @@
 import os
 
-from django.db.models.signals import pre_save, pre_delete, post_save
+from celery.signals import beat_init
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db.models.signals import pre_save, pre_delete, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 
-from .models import AplicacionWeb
+from .models import AplicacionWeb, Alerta, TipoNotificacion, Modulo, AgrupacionModulo, GrupoModulo, CustomUser, \
+    UserNotificationSetting
 from .utils import eliminar_imagenes
+from .cache_modulos import invalidar_cache_modulos
+from .cache_sitio import invalidar_cache_sitio
+from .preferencias_notificacion import invalidar_preferencias
+from .filtros_crud import invalidar_opciones_filtro, modelos_vigilados
+from .outbox import programar_relay
+from .notificaciones import TIPO_NOTIFICACION_CACHE_KEY
 
 
 @receiver(pre_save, sender=AplicacionWeb)
@@ -15,3 +25,58 @@ def pre_save_eliminar_imagen_antigua(sender, instance, **kwargs):
 def pre_delete_eliminar_imagen(sender, instance, **kwargs):
     eliminar_imagenes(sender, instance, ['logo', 'logo_horizontal', 'image_content', 'logo_webpush', 'social_images'], delete=True)
 
+
+@receiver(post_save, sender=Modulo)
+@receiver(post_delete, sender=Modulo)
+@receiver(post_save, sender=AgrupacionModulo)
+@receiver(post_delete, sender=AgrupacionModulo)
+@receiver(post_save, sender=GrupoModulo)
+@receiver(post_delete, sender=GrupoModulo)
+@receiver(post_delete, sender=Group)
+def invalidar_menu_modulos(sender, **kwargs):
+    invalidar_cache_modulos()
+
+@receiver(m2m_changed, sender=GrupoModulo.modulos.through)
+@receiver(m2m_changed, sender=AgrupacionModulo.modulos.through)
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+def invalidar_menu_modulos_m2m(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidar_cache_modulos()
+
+@receiver(post_save, sender=AplicacionWeb)
+@receiver(post_delete, sender=AplicacionWeb)
+@receiver(post_save, sender=Alerta)
+@receiver(post_delete, sender=Alerta)
+def invalidar_configuracion_sitio(sender, **kwargs):
+    invalidar_cache_sitio()
+
+@receiver(pre_save, sender=TipoNotificacion)
+def guardar_tipo_notificacion_anterior(sender, instance, **kwargs):
+    # Si se renombra `tipo`, también hay que invalidar la entrada del nombre anterior
+    instance._tipo_anterior = (
+        sender.objects.filter(pk=instance.pk).values_list('tipo', flat=True).first()
+        if instance.pk else None
+    )
+
+@receiver(post_save, sender=TipoNotificacion)
+@receiver(post_delete, sender=TipoNotificacion)
+def invalidar_tipo_notificacion(sender, instance, **kwargs):
+    tipos = {instance.tipo, getattr(instance, '_tipo_anterior', None)} - {None}
+    cache.delete_many([TIPO_NOTIFICACION_CACHE_KEY.format(tipo) for tipo in tipos])
+
+@receiver(post_save, sender=UserNotificationSetting)
+@receiver(post_delete, sender=UserNotificationSetting)
+def invalidar_preferencias_notificacion(sender, instance, **kwargs):
+    invalidar_preferencias(instance.user_id)
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidar_filtros_crud(sender, **kwargs):
+    # Solo los modelos con opciones de filtro cacheadas (set en memoria, sin consultas)
+    if sender in modelos_vigilados:
+        invalidar_opciones_filtro(sender)
+
+
+@beat_init.connect
+def programar_tareas_beat(sender, **kwargs):
+    programar_relay(sender.scheduler)
@@ -0,0 +1,216 @@
+"""
+Encolado de tareas Celery tolerante a caídas del broker.
+
+`encolar(task, *args)` publica en Celery mientras el broker responda. Al primer fallo
+se abre un circuit breaker (estado en memoria del proceso): las siguientes llamadas no
+esperan el timeout de conexión y dejan la tarea en una cola local acotada que atiende
+un hilo en segundo plano, nunca el hilo del request. Ese hilo arranca al abrirse el
+breaker (también si lo abre `publicar`), prueba el broker cada
+`TAREAS_BROKER_PROBE_INTERVAL` segundos y, cuando vuelve, cierra el breaker y reenvía la
+cola a Celery;
+las tareas que esperan más de `TAREAS_COLA_LOCAL_ESPERA` segundos se ejecutan en el hilo.
+Si el proyecto no configuró Celery (sin `broker_url`), las tareas se ejecutan en ese
+hilo sin esperar.
+
+Settings (opcionales):
+    TAREAS_BROKER_PROBE_INTERVAL = 5
+    TAREAS_BROKER_TIMEOUT = 1
+    TAREAS_COLA_LOCAL_MAX = 1000
+    TAREAS_COLA_LOCAL_ESPERA = 30
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from celery import current_app
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+def _intervalo():
+    return getattr(settings, "TAREAS_BROKER_PROBE_INTERVAL", 5)
+
+
+class _BrokerBreaker:
+    """Estado del broker en este proceso: cerrado (disponible) o abierto (caído)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.caido_desde = None
+        self.ultima_prueba = 0.0
+
+    def abierto(self):
+        return self.caido_desde is not None
+
+    def abrir(self, exc):
+        with self._lock:
+            if self.caido_desde is None:
+                self.caido_desde = time.monotonic()
+                logger.warning("Broker de Celery no disponible, se usa la cola local: %s", exc)
+            self.ultima_prueba = time.monotonic()
+
+    def cerrar(self):
+        with self._lock:
+            if self.caido_desde is not None:
+                logger.info(
+                    "Broker de Celery disponible otra vez tras %.0fs",
+                    time.monotonic() - self.caido_desde,
+                )
+            self.caido_desde = None
+
+    def toca_probar(self):
+        return time.monotonic() - self.ultima_prueba >= _intervalo()
+
+
+_breaker = _BrokerBreaker()
+
+
+def _probar_broker():
+    try:
+        with current_app.connection_for_write() as conn:
+            conn.ensure_connection(
+                max_retries=1,
+                interval_start=0,
+                interval_step=0,
+                timeout=getattr(settings, "TAREAS_BROKER_TIMEOUT", 1),
+            )
+    except Exception as exc:
+        _breaker.abrir(exc)
+        return False
+    _breaker.cerrar()
+    return True
+
+
+def celery_configurado():
+    """False si el proyecto no configuró un broker de Celery (ni `task_always_eager`)."""
+    conf = current_app.conf
+    return bool(conf.broker_url or conf.task_always_eager)
+
+
+def broker_disponible():
+    """False si el broker se marcó como caído; no hace ninguna conexión."""
+    return not _breaker.abierto()
+
+
+def publicar(task, args=(), kwargs=None, **opciones):
+    """
+    `task.apply_async` sin reintentos de publicación. Retorna False (sin esperar al
+    broker) si no hay Celery configurado o el breaker está abierto, o si la publicación
+    falla (y lo abre).
+    """
+    if _breaker.abierto() or not celery_configurado():
+        return False
+    try:
+        task.apply_async(args=args, kwargs=kwargs or {}, retry=False, **opciones)
+    except Exception as exc:
+        _breaker.abrir(exc)
+        # El hilo de la cola local es quien prueba el broker y cierra el breaker
+        _cola.asegurar_hilo()
+        return False
+    return True
+
+
+def _ejecutar_local(task, args, kwargs):
+    """Ejecuta `task` en este hilo. Retorna False si falló (el error queda en el log)."""
+    try:
+        task.apply(args=args, kwargs=kwargs, throw=True)
+    except Exception:
+        logger.exception("Error ejecutando %s fuera de Celery", task.name)
+        return False
+    finally:
+        close_old_connections()
+    return True
+
+
+class _ColaLocal:
+    """Cola acotada + hilo daemon (uno por proceso; se recrea tras un fork)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cola = None
+        self._hilo = None
+        self._pid = None
+
+    def asegurar_hilo(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._cola = queue.Queue(maxsize=getattr(settings, "TAREAS_COLA_LOCAL_MAX", 1000))
+                self._hilo = None
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name="core-cola-local", daemon=True)
+                self._hilo.start()
+
+    def poner(self, task, args, kwargs):
+        self.asegurar_hilo()
+        try:
+            self._cola.put_nowait((task, args, kwargs, time.monotonic()))
+            return True
+        except queue.Full:
+            return False
+
+    def _atender(self, task, args, kwargs, encolado_en):
+        espera_max = getattr(settings, "TAREAS_COLA_LOCAL_ESPERA", 30)
+        if not celery_configurado():
+            # Sin Celery no hay broker que esperar
+            _ejecutar_local(task, args, kwargs)
+            return
+        while True:
+            if _breaker.abierto() and _breaker.toca_probar():
+                _probar_broker()
+            if publicar(task, args, kwargs):
+                return
+            restante = espera_max - (time.monotonic() - encolado_en)
+            if restante <= 0:
+                _ejecutar_local(task, args, kwargs)
+                return
+            time.sleep(min(_intervalo(), restante))
+
+    def _bucle(self):
+        while True:
+            try:
+                item = self._cola.get(timeout=_intervalo())
+            except queue.Empty:
+                if _breaker.abierto() and _breaker.toca_probar():
+                    _probar_broker()
+                continue
+            try:
+                self._atender(*item)
+            except Exception:
+                logger.exception("Error en la cola local de tareas")
+            finally:
+                self._cola.task_done()
+
+    def vaciar(self):
+        """Al terminar el proceso: lo pendiente se ejecuta aquí para no perderlo."""
+        if self._cola is None or self._pid != os.getpid():
+            return
+        while True:
+            try:
+                task, args, kwargs, _ = self._cola.get_nowait()
+            except queue.Empty:
+                return
+            _ejecutar_local(task, args, kwargs)
+
+
+_cola = _ColaLocal()
+atexit.register(_cola.vaciar)
+
+
+def encolar(task, *args, **kwargs):
+    """
+    Publica `task` en Celery. Si el broker no está disponible la tarea queda en la cola
+    local (si está llena, se ejecuta en este hilo como último recurso).
+    Retorna True si se publicó en el broker.
+    """
+    if publicar(task, args, kwargs):
+        return True
+    if not _cola.poner(task, args, kwargs):
+        logger.warning("Cola local de tareas llena: %s se ejecuta en este hilo", task.name)
+        _ejecutar_local(task, args, kwargs)
+    return False
@@ -1,3 +1,324 @@
-from django.test import TestCase
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from celery import current_app, shared_task
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import notificaciones, outbox, tareas
+
+from .avisos_masivos import avisos_masivos_pendientes_para_usuario, insertar_lecturas_pendientes
+from .models import (
+    AvisoMasivo, AvisoMasivoLectura, CustomUser, NotificacionUsuario, OutboxMensaje, TipoNotificacion,
+)
+from .paginacion import _codificar, admite_keyset, orden_keyset, paginar_keyset
+from .views import ModelCRUDView
+
+
+class PaginacionKeysetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = CustomUser.objects.create(username='keyset', email='keyset@example.com')
+        cls.tipos = [
+            TipoNotificacion.objects.create(tipo=tipo, titulo=tipo, mensaje_final=tipo)
+            for tipo in ('c', 'a', 'b')
+        ]
+        for i in range(7):
+            NotificacionUsuario.objects.create(
+                usuario_notifica=cls.usuario, usuario_notificado=cls.usuario,
+                tipo=cls.tipos[i % 3], url=f'/n/{i}/',
+            )
+        for _ in range(5):
+            OutboxMensaje.objects.create(tarea='core.tarea')
+
+    def _recorrer(self, queryset, ordering, per_page=2):
+        pks, cursor = [], None
+        while True:
+            page = paginar_keyset(queryset, ordering, per_page, despues=cursor)
+            pks.extend(obj.pk for obj in page)
+            if not page.has_next():
+                return pks
+            cursor = page.next_cursor
+
+    def test_orden_con_campo_nullable_no_admite_keyset(self):
+        self.assertFalse(admite_keyset(OutboxMensaje, ['-enviado_en']))
+        with self.assertRaises(ValueError):
+            orden_keyset(['enviado_en'], OutboxMensaje)
+
+    def test_vista_con_orden_nullable_usa_paginator(self):
+        class OutboxCRUDView(ModelCRUDView):
+            model = OutboxMensaje
+            pagination = 'keyset'
+
+        view = OutboxCRUDView()
+        view.request = RequestFactory().get('/', {'page': 2})
+        page, is_paginated = view.paginate_queryset_keyset(
+            OutboxMensaje.objects.order_by('-enviado_en', '-pk'), ['-enviado_en'], paginate_by=2,
+        )
+        self.assertFalse(getattr(page, 'is_keyset', False))
+        self.assertEqual(page.number, 2)
+        self.assertTrue(is_paginated)
+
+    def test_cursor_con_tipo_invalido_vuelve_a_la_primera_pagina(self):
+        queryset = OutboxMensaje.objects.all()
+        primera = paginar_keyset(queryset, ['id'], 2)
+        for cursor in (_codificar(['abc']), _codificar([None]), 'no-es-un-cursor'):
+            page = paginar_keyset(queryset, ['id'], 2, despues=cursor)
+            self.assertEqual([m.pk for m in page], [m.pk for m in primera])
+
+    def test_orden_por_fk_compara_por_la_columna(self):
+        self.assertEqual(orden_keyset(['tipo'], NotificacionUsuario)[0][0], 'tipo_id')
+        queryset = NotificacionUsuario.objects.all()
+        esperados = list(queryset.order_by('tipo_id', 'pk').values_list('pk', flat=True))
+        self.assertEqual(self._recorrer(queryset, ['tipo']), esperados)
+
+    def test_pagina_anterior_con_orden_descendente(self):
+        queryset = NotificacionUsuario.objects.all()
+        ordering = ['-tipo', 'id']
+        esperados = self._recorrer(queryset, ordering)
+        self.assertEqual(sorted(esperados), sorted(queryset.values_list('pk', flat=True)))
+        primera = paginar_keyset(queryset, ordering, 2)
+        segunda = paginar_keyset(queryset, ordering, 2, despues=primera.next_cursor)
+        anterior = paginar_keyset(queryset, ordering, 2, antes=segunda.previous_cursor)
+        self.assertEqual([n.pk for n in segunda], esperados[2:4])
+        self.assertEqual([n.pk for n in anterior], esperados[:2])
+
+
+@shared_task(name='core.tests.tarea_prueba')
+def tarea_prueba(valor):
+    return valor
+
+
+@shared_task(name='core.tests.tarea_falla')
+def tarea_falla(valor):
+    raise RuntimeError('falla')
+
+
+def _esperar(condicion, timeout=3):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if condicion():
+            return True
+        time.sleep(0.01)
+    return condicion()
+
+
+class _BrokerFalso:
+    """Broker de prueba: con `caido` fallan la publicación y la prueba de conexión."""
+
+    def __init__(self):
+        self.caido = True
+        self.publicadas = []
+
+    def apply_async(self, args=(), kwargs=None, **opciones):
+        if self.caido:
+            raise ConnectionError('broker caído')
+        self.publicadas.append((tuple(args), opciones))
+
+    def connection_for_write(self):
+        return mock.MagicMock(**{
+            '__enter__.return_value.ensure_connection.side_effect': self._conectar,
+        })
+
+    def _conectar(self, **kwargs):
+        if self.caido:
+            raise ConnectionError('broker caído')
+
+    def parches(self, *tasks):
+        parches = [
+            mock.patch.object(tareas, 'celery_configurado', return_value=True),
+            mock.patch.object(current_app, 'connection_for_write', self.connection_for_write),
+        ]
+        parches += [mock.patch.object(task, 'apply_async', self.apply_async) for task in tasks]
+        return parches
+
+
+@override_settings(TAREAS_BROKER_PROBE_INTERVAL=0.05, TAREAS_COLA_LOCAL_ESPERA=30)
+class BrokerBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        tareas._breaker.cerrar()
+        self.addCleanup(tareas._breaker.cerrar)
+        self.broker = _BrokerFalso()
+        for parche in self.broker.parches(tarea_prueba):
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def test_encolar_con_broker_caido_reenvia_a_celery_al_volver(self):
+        self.assertFalse(tareas.encolar(tarea_prueba, 1))
+        self.assertFalse(tareas.broker_disponible())
+        self.assertEqual(self.broker.publicadas, [])
+
+        self.broker.caido = False
+        self.assertTrue(_esperar(lambda: self.broker.publicadas))
+        self.assertEqual(self.broker.publicadas[0][0], (1,))
+        self.assertTrue(tareas.broker_disponible())
+
+    def test_breaker_abierto_por_publicar_se_cierra_al_volver_el_broker(self):
+        self.assertFalse(tareas.publicar(tarea_prueba, (1,)))
+        # Con el breaker abierto no se intenta publicar
+        self.broker.caido = False
+        self.assertFalse(tareas.publicar(tarea_prueba, (2,)))
+        self.assertEqual(self.broker.publicadas, [])
+
+        self.assertTrue(_esperar(tareas.broker_disponible))
+        self.assertTrue(tareas.publicar(tarea_prueba, (3,)))
+        self.assertEqual([args for args, _ in self.broker.publicadas], [(3,)])
+
+
+@override_settings(TAREAS_BROKER_PROBE_INTERVAL=0.05, TAREAS_COLA_LOCAL_ESPERA=30)
+class OutboxRelayTests(TestCase):
+
+    def setUp(self):
+        tareas._breaker.cerrar()
+        self.addCleanup(tareas._breaker.cerrar)
+        self.broker = _BrokerFalso()
+        parches = self.broker.parches(tarea_prueba, outbox.relay_outbox_task)
+        # Dentro del TestCase no se debe cerrar la conexión de la transacción de prueba
+        parches.append(mock.patch.object(tareas, 'close_old_connections'))
+        for parche in parches:
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def test_broker_caido_el_outbox_se_entrega_a_celery_al_volver(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            mensaje = outbox.registrar(tarea_prueba, 7)
+        self.assertFalse(tareas.broker_disponible())
+        self.assertEqual(self.broker.publicadas, [])
+
+        self.broker.caido = False
+        self.assertTrue(_esperar(lambda: self.broker.publicadas))
+        self.assertTrue(tareas.broker_disponible())
+        self.assertEqual(self.broker.publicadas[0][0], ([mensaje.pk],))
+
+        # Lo que haría el worker con el relay publicado
+        self.assertEqual(outbox.relay_outbox(ids=[mensaje.pk]), 1)
+        args, opciones = self.broker.publicadas[1]
+        self.assertEqual((args, opciones['task_id']), ((7,), f'outbox-{mensaje.pk}'))
+        mensaje.refresh_from_db()
+        self.assertIsNotNone(mensaje.enviado_en)
+
+    def test_ejecucion_local_solo_marca_las_tareas_exitosas(self):
+        ok = outbox.registrar(tarea_prueba, 1)
+        falla = outbox.registrar(tarea_falla, 2)
+        with self.assertLogs('core.tareas', 'ERROR'):
+            self.assertEqual(outbox.relay_outbox(ids=[ok.pk, falla.pk]), 1)
+        ok.refresh_from_db()
+        falla.refresh_from_db()
+        self.assertIsNotNone(ok.enviado_en)
+        self.assertIsNone(falla.enviado_en)
+
+
+def _destinatario(pk, endpoint):
+    return SimpleNamespace(
+        id=pk, subscription_id=pk, subscription=SimpleNamespace(endpoint=endpoint),
+    )
+
+
+@override_settings(
+    WEBPUSH_TRANSIENT_MAX_ATTEMPTS=3,
+    WEBPUSH_RETRY_INLINE_MAX_SECONDS=10,
+    WEBPUSH_RETRY_AFTER_MAX_SECONDS=60,
+    WEBPUSH_BREAKER_THRESHOLD=2,
+)
+class WebPushDispatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.breaker = notificaciones._OriginCircuitBreaker()
+        parche = mock.patch.object(notificaciones, '_breaker', self.breaker)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_retry_after_en_segundos_fecha_http_o_invalido(self):
+        def respuesta(valor):
+            return SimpleNamespace(headers={'Retry-After': valor} if valor is not None else {})
+
+        fecha = format_datetime(datetime.now(dt_timezone.utc) + timedelta(seconds=30), usegmt=True)
+        self.assertEqual(notificaciones._retry_after_seconds(respuesta('7')), 7)
+        self.assertTrue(25 <= notificaciones._retry_after_seconds(respuesta(fecha)) <= 30)
+        self.assertEqual(notificaciones._retry_after_seconds(respuesta('mañana')), 5)
+        self.assertEqual(notificaciones._retry_after_seconds(respuesta(None)), 5)
+        # Acotado entre 1 y WEBPUSH_RETRY_AFTER_MAX_SECONDS
+        self.assertEqual(notificaciones._retry_after_seconds(respuesta('3600')), 60)
+        self.assertEqual(notificaciones._retry_after_seconds(respuesta('0')), 1)
+
+    def test_breaker_por_origen(self):
+        self.breaker.registrar('fcm.googleapis.com', 'transient')
+        self.assertEqual(self.breaker.espera('fcm.googleapis.com'), 0)
+        self.breaker.registrar('fcm.googleapis.com', 'sent')
+        # Un éxito reinicia la racha: hacen falta otros dos errores seguidos
+        self.breaker.registrar('fcm.googleapis.com', 'transient')
+        self.assertEqual(self.breaker.espera('fcm.googleapis.com'), 0)
+        self.breaker.registrar('fcm.googleapis.com', 'transient')
+        self.assertGreater(self.breaker.espera('fcm.googleapis.com'), 0)
+        self.assertEqual(self.breaker.espera('updates.push.services.mozilla.com'), 0)
+
+        self.breaker.registrar('web.push.apple.com', 'throttled', 30)
+        self.assertGreater(self.breaker.espera('web.push.apple.com'), 25)
+
+    def test_429_difiere_solo_ese_origen_y_reintenta_tras_retry_after(self):
+        fcm = _destinatario(1, 'https://fcm.googleapis.com/fcm/send/a')
+        mozilla = _destinatario(2, 'https://updates.push.services.mozilla.com/wpush/v2/b')
+        envios = []
+
+        def despachar(recipient, *args, **kwargs):
+            envios.append((recipient.id, time.monotonic()))
+            if recipient is fcm and len([pk for pk, _ in envios if pk == 1]) == 1:
+                return 'throttled', 1
+            return 'sent', 0
+
+        dispatcher = notificaciones.WebPushDispatcher('{}', {})
+        with mock.patch.object(notificaciones, '_dispatch_webpush', side_effect=despachar):
+            dispatcher.submit(fcm)
+            self.assertTrue(_esperar(lambda: not dispatcher._pending))
+            dispatcher.submit(mozilla)
+            self.assertGreater(self.breaker.espera('fcm.googleapis.com'), 0)
+            self.assertEqual(self.breaker.espera('updates.push.services.mozilla.com'), 0)
+            report = dispatcher.close()
+
+        self.assertEqual(report, {'sent': 2, 'deleted': 0, 'failed': 0, 'rescheduled': 0})
+        self.assertEqual([pk for pk, _ in envios], [1, 2, 1])
+        intentos_fcm = [t for pk, t in envios if pk == 1]
+        self.assertGreaterEqual(intentos_fcm[1] - intentos_fcm[0], 0.9)
+        # El otro origen no esperó el Retry-After
+        self.assertLess(envios[1][1] - envios[0][1], 0.9)
+
+
+class InsertarLecturasPendientesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = CustomUser.objects.create(username='avisos', email='avisos@example.com')
+        ahora = timezone.now()
+        cls.avisos = [
+            AvisoMasivo.objects.create(titulo=f'aviso {i}', publicado_en=ahora - timedelta(minutes=1))
+            for i in range(3)
+        ]
+        # No vigentes: sin publicar, inactivo y vencido
+        AvisoMasivo.objects.create(titulo='borrador')
+        AvisoMasivo.objects.create(titulo='inactivo', activo=False, publicado_en=ahora)
+        AvisoMasivo.objects.create(
+            titulo='vencido', publicado_en=ahora - timedelta(days=2),
+            vigente_hasta=ahora - timedelta(days=1),
+        )
+
+    def test_inserta_solo_los_pendientes(self):
+        AvisoMasivoLectura.objects.create(aviso=self.avisos[0], usuario=self.usuario)
+
+        self.assertEqual(insertar_lecturas_pendientes(self.usuario), 2)
+        self.assertEqual(insertar_lecturas_pendientes(self.usuario), 0)
+        self.assertFalse(avisos_masivos_pendientes_para_usuario(self.usuario).exists())
+        self.assertEqual(
+            set(AvisoMasivoLectura.objects.filter(usuario=self.usuario).values_list('aviso_id', flat=True)),
+            {aviso.pk for aviso in self.avisos},
+        )
+
+    def test_no_toca_las_lecturas_de_otros_usuarios(self):
+        otro = CustomUser.objects.create(username='otro', email='otro@example.com')
+        self.assertEqual(insertar_lecturas_pendientes(self.usuario), 3)
+        self.assertEqual(avisos_masivos_pendientes_para_usuario(otro).count(), 3)
+        self.assertEqual(insertar_lecturas_pendientes(otro), 3)
@@ -18,7 +18,7 @@ from django.conf import settings
 from django.core.files.storage import FileSystemStorage
 from django.views.generic.base import ContextMixin
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q
 from django.db import models
 from django.contrib.sites.models import Site
 from django.views.decorators.http import require_POST
@@ -26,7 +26,6 @@ from django.forms import modelform_factory
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage, InvalidPage
 from django.utils.safestring import mark_safe
 from django.utils.html import format_html
-from django.utils.dateparse import parse_date, parse_datetime
 from django.utils.http import url_has_allowed_host_and_scheme
 import datetime
 from django.utils import timezone
@@ -44,8 +43,14 @@ from google.auth.transport import requests as g_requests
 import urllib
 
 from .mixins import SecureModuleMixin
-from .models import NotificacionUsuario, NotificacionUsuarioCount, CustomUser, AgrupacionModulo, Modulo, AvisoMasivoLectura
+from .crud_columnas import compilar_columna
+from .crud_consultas import cruza_multivaluada, paths_export_fields, paths_list_display, plan_relaciones
+from .filtros_crud import TIPO_AUTOCOMPLETE, TIPO_LISTA, TIPO_TEXTO, opciones_relacion, opciones_valores, \
+    vigilar_filtros, widget_autocomplete
+from .paginacion import PARAM_ANTES, PARAM_DESPUES, admite_keyset, paginar_keyset
+from .models import NotificacionUsuario, CustomUser, AgrupacionModulo, Modulo, AvisoMasivoLectura
 from .avisos_masivos import marcar_todos_avisos_masivos_vistos
+from .contador_notificaciones import resetear_contador
 from .forms import ModelBaseForm
 from .forms import configure_auto_complete_widgets
 
@@ -212,17 +217,7 @@ def api(request):
             if action == 'reset_notificacion':
                 if request.user.is_authenticated:
                     # Contador: siempre el usuario de la sesion (no depender de user_id en el JSON)
-                    u = request.user
-                    nup = NotificacionUsuarioCount.objects.filter(usuario=u).update(numero=0)
-                    if nup == 0:
-                        NotificacionUsuarioCount.objects.get_or_create(
-                            usuario=u,
-                            defaults={
-                                'numero': 0,
-                                'created_by': u,
-                                'modified_by': u,
-                            },
-                        )
+                    resetear_contador(request.user.pk)
                     marcar_todos_avisos_masivos_vistos(request.user)
                 return success_json(mensaje="Notificacion reseteada")
             
@@ -621,11 +616,8 @@ class ViewAdministracionBase(LoginRequiredMixin, SecureModuleMixin, ViewClassBas
             url_actual = self.request.path
             
             for agrupacion in agrupaciones:
-                # Obtener módulos según el tipo de usuario
-                if self.request.user.is_superuser:
-                    modulos = agrupacion.modulos_activos
-                else:
-                    modulos = getattr(agrupacion, 'modulos_permitidos', [])
+                # Módulos ya resueltos en el cache (superusuario: todos los activos)
+                modulos = getattr(agrupacion, 'modulos_permitidos', [])
                 
                 # Verificar si algún módulo está activo (su URL coincide con la actual)
                 for modulo in modulos:
@@ -636,8 +628,7 @@ class ViewAdministracionBase(LoginRequiredMixin, SecureModuleMixin, ViewClassBas
                         break
                 
                 # Asegurar que tenemos la propiedad correcta para el template
-                if not self.request.user.is_superuser:
-                    agrupacion.modulos_activos_filtrados = modulos
+                agrupacion.modulos_activos_filtrados = modulos
             
             context['agrupacion_modulos'] = agrupaciones
         return context
@@ -676,6 +667,12 @@ class ModelCRUDView(ViewAdministracionBase):
     - `raw_id_fields`: Campos que se mostrarán como campos de búsqueda (opcional).
     - `auto_complete_fields`: Campos que se beneficiarán de la búsqueda automática (opcional).
     - `ordering`: Lista de campos para ordenar el queryset (opcional, por defecto ['-id']).
+    - `auto_related`: Aplica `select_related`/`prefetch_related` deducidos de `list_display`
+      y `export_fields` (opcional, por defecto True). Para ajustarlo por vista, sobrescribe
+      `get_related_lookups()`.
+    - `pagination`: 'offset' (por defecto, páginas numeradas) o 'keyset' (cursores
+      ?despues=/?antes= sobre `ordering` + pk, sin OFFSET; para tablas grandes).
+    - `pagination_count`: total en modo keyset: 'exact', 'estimated' (PostgreSQL) o None.
     """
     model = None
     form_class = None
@@ -689,6 +686,9 @@ class ModelCRUDView(ViewAdministracionBase):
     raw_id_fields = []
     auto_complete_fields = []
     ordering = ['-id']  # Ordenamiento por defecto
+    auto_related = True
+    pagination = 'offset'
+    pagination_count = 'exact'
     form_fields = None
     inlines = None
     readonly_fields = ()
@@ -724,6 +724,12 @@ class ModelCRUDView(ViewAdministracionBase):
         },
     ]
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Para invalidar el cache de opciones de filtro al modificar esos modelos
+        if cls.model is not None and cls.list_filter:
+            vigilar_filtros(cls.model, cls.list_filter)
+
     def get_readonly_fields(self, obj=None):
         """Hook declarativo estilo admin para campos readonly en formularios CRUD."""
         return tuple(self.readonly_fields or ())
@@ -743,7 +749,7 @@ class ModelCRUDView(ViewAdministracionBase):
                 actions.append({**a, "url": url})
         return actions
     
-    def _querystring(self, exclude=('page','pagina')):
+    def _querystring(self, exclude=('page', 'pagina', PARAM_DESPUES, PARAM_ANTES)):
         """Devuelve la query-string actual sin los parámetros excluidos."""
         params = self.request.GET.copy()
         for p in exclude:
@@ -796,6 +802,30 @@ class ModelCRUDView(ViewAdministracionBase):
             page_obj = paginator.page(paginator.num_pages)
 
         return page_obj, paginator.num_pages > 1
+
+    def paginate_queryset_keyset(self, queryset, ordering, paginate_by=None):
+        """
+        Devuelve (page_obj, is_paginated) paginando por keyset con los cursores
+        ?despues= / ?antes= de la querystring (ver core/paginacion.py). Si `ordering`
+        no lo admite (campos que aceptan NULL, relaciones multivaluadas, expresiones)
+        pagina con el `Paginator`.
+        """
+        if paginate_by is None:
+            paginate_by = self.paginate_by
+        if paginate_by is None:
+            return queryset, False
+        if not admite_keyset(queryset.model, ordering):
+            return self.paginate_queryset(queryset, paginate_by=paginate_by)
+
+        page_obj = paginar_keyset(
+            queryset,
+            ordering,
+            paginate_by,
+            despues=self.request.GET.get(PARAM_DESPUES),
+            antes=self.request.GET.get(PARAM_ANTES),
+            conteo=self.pagination_count,
+        )
+        return page_obj, page_obj.has_other_pages()
         
 
     def dispatch(self, request, *args, **kwargs):
@@ -879,7 +909,7 @@ class ModelCRUDView(ViewAdministracionBase):
             for word in search.strip().split():
                 q = Q()
                 for field in self.search_fields:
-                    q |= Q(**{f"{field}__icontains": word})
+                    q |= self._lookup_q(f"{field}__icontains", word)
                 queryset = queryset.filter(q)
 
         # --- Filtros ---
@@ -892,11 +922,56 @@ class ModelCRUDView(ViewAdministracionBase):
                 
             value = self.request.GET.get(field_name)
             if value not in [None, ""]:
-                queryset = queryset.filter(**{field_name: value})
+                queryset = queryset.filter(self._lookup_q(field_name, value))
         
-        return queryset.distinct()  # Elimina duplicados si hay joins
+        # --- Relaciones que se muestran (evita una consulta por celda) ---
+        if self.auto_related:
+            select_related, prefetch_related = self.get_related_lookups()
+            if select_related:
+                queryset = queryset.select_related(*select_related)
+            if prefetch_related:
+                queryset = queryset.prefetch_related(*prefetch_related)
+
+        # Los filtros sobre relaciones M2M/inversas ya van con Exists(): solo un
+        # ordenamiento por esas relaciones puede repetir filas
+        if any(cruza_multivaluada(self.model, o.lstrip('-+')) for o in self.get_ordering() or () if isinstance(o, str)):
+            queryset = queryset.distinct()
+        return queryset
+
+    def _lookup_q(self, lookup, value):
+        """
+        Q para `lookup=value`. Si el lookup atraviesa una relación M2M o inversa se usa
+        una subconsulta Exists(): el JOIN repetiría filas y obligaría a usar DISTINCT.
+        """
+        if cruza_multivaluada(self.model, lookup):
+            return Q(Exists(
+                self.model.objects.filter(pk=OuterRef('pk'), **{lookup: value})
+            ))
+        return Q(**{lookup: value})
+
+    def get_related_lookups(self):
+        """
+        Retorna (select_related, prefetch_related) para el listado, deducidos de los paths
+        de `list_display` (y de `export_fields` al exportar): cadenas FK/O2O con
+        `select_related`, M2M y relaciones inversas con `prefetch_related`.
+        El análisis se cachea por modelo y paths. Sobrescribir para ajustarlo, p.ej.:
+
+            def get_related_lookups(self):
+                select_related, prefetch_related = super().get_related_lookups()
+                return select_related + ['autor__pais'], prefetch_related
+        """
+        paths = paths_list_display(self.get_list_display(getattr(self, 'request', None)))
+        if getattr(self, 'action', None) == 'export':
+            paths += paths_export_fields(self.export_fields)
+        select_related, prefetch_related = plan_relaciones(self.model, paths)
+        return list(select_related), list(prefetch_related)
     
     def get_filter_options(self):
+        """
+        Opciones de los filtros de `list_filter`, cacheadas (ver core/filtros_crud.py).
+        Cada opción tiene `tipo`: 'lista' (choices), 'autocomplete' (relación con
+        demasiados objetos: `widget` + `hidden`) o 'texto' (demasiados valores: `hidden`).
+        """
         options = []
         for filter_item in self.list_filter:
             # Soporte para tuplas personalizadas: ("Nombre Custom", "campo")
@@ -909,6 +984,8 @@ class ModelCRUDView(ViewAdministracionBase):
                 header = get_header(self.model, path).lower()
             
             field, final_model = _get_field_from_path(self.model, path)
+            tipo = TIPO_LISTA
+            widget = None
 
             # 1) Field con choices
             if field.choices:
@@ -918,7 +995,7 @@ class ModelCRUDView(ViewAdministracionBase):
             elif field.get_internal_type() in ("BooleanField", "NullBooleanField"):
                 choices = [("1", "Sí"), ("0", "No")]
 
-            # 3) Relación   -> lista objetos relacionados
+            # 3) Relación   -> objetos relacionados (o autocompletado si son muchos)
             elif field.is_relation:
                 # Usar verbose_name_plural del modelo relacionado si existe y no hay header personalizado
                 if (not isinstance(filter_item, tuple) and 
@@ -926,23 +1003,33 @@ class ModelCRUDView(ViewAdministracionBase):
                     final_model._meta.verbose_name_plural):
                     header = final_model._meta.verbose_name_plural.lower()
                 
-                rel_qs  = final_model.objects.all()
-                choices = [(obj.pk, str(obj)) for obj in rel_qs]
+                tipo, choices = opciones_relacion(final_model)
+                if tipo == TIPO_AUTOCOMPLETE:
+                    widget = widget_autocomplete(final_model, path, self.request.GET.get(path))
+                    if widget is None:
+                        tipo = TIPO_TEXTO
 
-            # 4) Otros      -> valores distintos
+            # 4) Otros      -> valores distintos (o texto libre si son muchos)
             else:
-                vals = (self.model.objects
-                                .values_list(path, flat=True)
-                                .distinct()
-                                .order_by())
-                choices = [(v, v) for v in vals if v is not None]
+                tipo, choices = opciones_valores(self.model, path, final_model)
 
             # Devolver diccionario con header y nombre real del campo
-            options.append({
+            option = {
                 'header': header,
                 'field_name': path,  # Nombre real del campo para usar en el formulario
-                'choices': choices
-            })
+                'choices': choices,
+                'tipo': tipo,
+            }
+            if tipo != TIPO_LISTA:
+                option['widget'] = widget
+                # Parámetros actuales que el formulario del filtro debe conservar
+                excluir = {path, 'page', 'pagina', PARAM_DESPUES, PARAM_ANTES}
+                option['hidden'] = [
+                    (key, value)
+                    for key, values in self.request.GET.lists() if key not in excluir
+                    for value in values
+                ]
+            options.append(option)
         return options 
     
     def get_ordering(self):
@@ -1021,46 +1108,9 @@ class ModelCRUDView(ViewAdministracionBase):
         para que el template tenga el objeto (para las acciones)
         y las celdas ya renderizadas.
         """
-        rows = []
-        for o in objs:
-            cells = []
-            for spec in specs:
-                value = spec(o) if callable(spec) else resolve_attr(o, spec)
-
-                # Formatear fechas/hora a zona local antes de renderizar
-                try:
-                    # datetime.datetime (con o sin tzinfo)
-                    if isinstance(value, datetime.datetime):
-                        if settings.USE_TZ:
-                            try:
-                                value = timezone.localtime(value)
-                            except Exception:
-                                # si no se puede convertir, usar el valor original
-                                pass
-                        value = value.strftime("%d/%m/%Y %H:%M")
-                    # datetime.date (sin hora)
-                    elif isinstance(value, datetime.date):
-                        value = value.strftime("%d/%m/%Y")
-                    elif isinstance(value, str):
-                        parsed_datetime = parse_datetime(value)
-                        if parsed_datetime is not None:
-                            if settings.USE_TZ:
-                                try:
-                                    parsed_datetime = timezone.localtime(parsed_datetime)
-                                except Exception:
-                                    pass
-                            value = parsed_datetime.strftime("%d/%m/%Y %H:%M")
-                        else:
-                            parsed_date = parse_date(value)
-                            if parsed_date is not None:
-                                value = parsed_date.strftime("%d/%m/%Y")
-                except Exception:
-                    # Si cualquier cosa falla al formatear, caeremos al str(value)
-                    pass
-
-                # Finalmente forzamos a string antes de marcar como safe
-                cells.append(mark_safe(str(value)))
-            rows.append((o, cells))
+        # Un accesor por columna, compilado según el tipo de campo (cacheado por modelo y path)
+        accessors = [compilar_columna(self.model, spec) for spec in specs]
+        rows = [(o, [mark_safe(accessor(o)) for accessor in accessors]) for o in objs]
         return rows
 
     def post(self, request, *args, **kwargs):
@@ -1125,7 +1175,10 @@ class ModelCRUDView(ViewAdministracionBase):
         if ordering:
             qs = qs.order_by(*ordering)
             
-        page_obj, is_paginated = self.paginate_queryset(qs)
+        if self.pagination == 'keyset':
+            page_obj, is_paginated = self.paginate_queryset_keyset(qs, ordering)
+        else:
+            page_obj, is_paginated = self.paginate_queryset(qs)
 
         context.update({
             "page_obj":      page_obj,
@@ -1160,6 +1213,9 @@ class ModelCRUDView(ViewAdministracionBase):
 
         if self.list_filter:
             context['filter_options'] = self.get_filter_options()
+            widgets = [o['widget'] for o in context['filter_options'] if o.get('widget') is not None]
+            if widgets:
+                context['filter_media'] = sum((w.field.widget.media for w in widgets), forms.Media())
         
         # Agregar información sobre exportación Excel
         context['can_export'] = bool(self.export_headers and self.export_fields)
@@ -9,6 +9,7 @@ from core.administracion_forms import AgrupacionModuloForm, GrupoForm, ModuloFor
 from django.contrib.auth.models import Group
 
 from core.utils import error_json, success_json, get_redirect_url
+from core.cache_modulos import invalidar_cache_modulos
 
 class AgrupacionModulosView(ModelCRUDView):
     model = AgrupacionModulo
@@ -35,6 +36,8 @@ class AgrupacionModulosView(ModelCRUDView):
             # Actualizar el orden de cada agrupación
             for index, agrupacion_id in enumerate(orden_ids, start=1):
                 AgrupacionModulo.objects.filter(id=agrupacion_id).update(orden=index)
+            # update() no emite signals: invalidar el menú cacheado
+            invalidar_cache_modulos()
             
             return success_json(mensaje="Orden actualizado correctamente")
         except Exception as e:
@@ -53,6 +56,7 @@ class AgrupacionModulosView(ModelCRUDView):
                 modulo_id = item.get('id')
                 orden = item.get('orden')
                 Modulo.objects.filter(id=modulo_id).update(orden=orden)
+            invalidar_cache_modulos()
             
             return success_json(mensaje="Orden de módulos actualizado correctamente")
         except Exception as e:
@@ -1,11 +1,14 @@
 from django.shortcuts import render
+from django.http import JsonResponse
 from django.contrib import messages
 
 from django.conf import settings
 from django.utils import timezone
 from django.utils.http import url_has_allowed_host_and_scheme
 
-from core.models import CustomUser, AplicacionWeb, AvisoMasivo
+from core.models import CustomUser, AvisoMasivo, CampanaPush
+from core.campanas_push import progreso_campana
+from core.cache_sitio import get_aplicacion_web
 from core.views import ViewAdministracionBase
 from core.administracion_forms import NotificacionPushUsuarioForm, NotificacionAppUsuarioForm, \
     NotificacionPushAppUsuarioForm, NotificacionPushMasivaForm, AvisoMasivoEnviarForm, \
@@ -45,7 +48,7 @@ class NotificacionesPushAppView(ViewAdministracionBase):
         return error_json(mensaje="Acción no permitida")
     
     def post_notificaciones_push_usuario(self, request, context, *args, **kwargs):
-        logo_url = AplicacionWeb.objects.first().logo.url
+        logo_url = get_aplicacion_web().logo.url
 
         form = NotificacionPushUsuarioForm(request.POST)
         if form.is_valid():
@@ -97,7 +100,7 @@ class NotificacionesPushAppView(ViewAdministracionBase):
             return _success_recarga(request, "Notificación enviada correctamente")
 
     def post_notificaciones_push_masiva(self, request, context, *args, **kwargs):
-        application = AplicacionWeb.objects.first()
+        application = get_aplicacion_web()
         logo_url = application.logo.url if application and application.logo else ''
         group_name = application.group_name_webpush if application and application.group_name_webpush else 'Main'
         form = NotificacionPushMasivaForm(request.POST)
@@ -113,6 +116,8 @@ class NotificacionesPushAppView(ViewAdministracionBase):
                 group_name=group_name,
                 payload=payload,
                 report_email=getattr(request.user, "email", None),
+                ttl=getattr(settings, "WEBPUSH_MASIVO_TTL", 60 * 60 * 24),
+                topic="push-masiva",
             )
             if not sent:
                 m = (
@@ -124,7 +129,8 @@ class NotificacionesPushAppView(ViewAdministracionBase):
             return _success_recarga(
                 request,
                 "Notificación Web Push masiva enviada correctamente. "
-                "La recibirán los dispositivos suscritos (según cola o envío inmediato).",
+                "La recibirán los dispositivos suscritos (según cola o envío inmediato). "
+                f"Campaña: {sent.codigo}",
             )
         else:
             return error_json(mensaje=str(form.errors))
@@ -165,7 +171,7 @@ class NotificacionesPushAppView(ViewAdministracionBase):
                 "Aviso masivo publicado correctamente (solo en el sitio). "
                 "Los usuarios lo verán en su campanita de notificaciones.",
             )
-        application = AplicacionWeb.objects.first()
+        application = get_aplicacion_web()
         logo_url = application.logo.url if application and application.logo else ""
         group_name = (
             application.group_name_webpush
@@ -180,10 +186,13 @@ class NotificacionesPushAppView(ViewAdministracionBase):
             "icon": f"{URL_BASE}{logo_url}" if logo_url else "",
             "url": (d.get("url") or "").strip() or "/",
         }
+        # Un aviso nuevo reemplaza al anterior aún no entregado
         sent = send_notification_to_group(
             group_name=group_name,
             payload=payload,
             report_email=getattr(request.user, "email", None),
+            ttl=getattr(settings, "WEBPUSH_MASIVO_TTL", 60 * 60 * 24),
+            topic="aviso-masivo",
         )
         if not sent:
             m = (
@@ -207,6 +216,30 @@ class NotificacionesPushAppView(ViewAdministracionBase):
         
         return render(request, 'core/administracion/notificaciones/pushapp.html', context)
 
+    def get_campana_push_progreso(self, request, context, *args, **kwargs):
+        """
+        JSON con el progreso de una campaña push (`?codigo=`) o de las últimas
+        `limite` campañas, para consultar periódicamente desde la página.
+        """
+        codigo = request.GET.get('codigo')
+        if codigo:
+            campana = CampanaPush.objects.filter(codigo=codigo).first()
+            if campana is None:
+                return error_json(mensaje="Campaña no encontrada")
+            return success_json(resp=progreso_campana(campana))
+
+        try:
+            limite = max(1, min(int(request.GET.get('limite', 10)), 100))
+        except ValueError:
+            limite = 10
+        campanas = CampanaPush.objects.order_by('-created_at')[:limite]
+        # success_json omite `resp` vacío: la lista va siempre, aunque no haya campañas
+        return JsonResponse({
+            'result': 'ok',
+            'redirected': False,
+            'resp': [progreso_campana(campana) for campana in campanas],
+        })
+
     def get_notificaciones_android_masiva(self, request, context, *args, **kwargs):
         context['title'] = 'Enviar notificación a todos los usuarios'
         context['message'] = 'Se enviará una notificación a todos los usuarios'
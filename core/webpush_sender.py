@@ -0,0 +1,93 @@
+"""
+Recursos reutilizables para el envío de Web Push, compartidos por los hilos del proceso.
+
+- Cabecera VAPID `Authorization` firmada una vez por audiencia (servicio push) y
+  reutilizada hasta poco antes de su `exp`: evita una firma ECDSA por notificación.
+- Una `requests.Session` con keep-alive por origen, con tantas conexiones como
+  hilos de envío tenga ese origen: evita un handshake TLS por notificación.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from celery.signals import worker_process_shutdown, worker_shutdown
+from django.conf import settings
+from py_vapid import Vapid
+from requests.adapters import HTTPAdapter
+
+_lock = threading.Lock()
+_vapid_keys = {}
+_vapid_headers = {}
+_sessions = {}
+
+
+def _audience(endpoint):
+    url = urlparse(endpoint or "")
+    return f"{url.scheme}://{url.netloc}"
+
+
+def _vapid_key(private_key):
+    vapid = _vapid_keys.get(private_key)
+    if vapid is None:
+        if os.path.isfile(private_key):
+            vapid = Vapid.from_file(private_key_file=private_key)
+        else:
+            vapid = Vapid.from_string(private_key=private_key)
+        _vapid_keys[private_key] = vapid
+    return vapid
+
+
+def vapid_headers(endpoint, vapid_data):
+    """
+    Cabeceras VAPID para `endpoint` (dict vacío si no hay clave configurada).
+    `vapid_data` es el dict de `_get_vapid_data()`; no se modifica.
+    """
+    private_key = vapid_data.get("vapid_private_key")
+    if not private_key:
+        return {}
+
+    claims = vapid_data.get("vapid_claims") or {}
+    aud = _audience(endpoint)
+    key = (private_key, claims.get("sub"), aud)
+    now = time.time()
+    # Margen para no enviar un token que expire en tránsito
+    margin = getattr(settings, "WEBPUSH_VAPID_RENEW_MARGIN", 10 * 60)
+
+    with _lock:
+        cached = _vapid_headers.get(key)
+        if cached is not None and cached[1] - margin > now:
+            return cached[0]
+
+        exp = int(now) + getattr(settings, "WEBPUSH_VAPID_EXP_SECONDS", 12 * 60 * 60)
+        headers = _vapid_key(private_key).sign({**claims, "aud": aud, "exp": exp})
+        _vapid_headers[key] = (headers, exp)
+        return headers
+
+
+def session_for(origin, pool_size=10):
+    """`requests.Session` keep-alive del origen, con `pool_size` conexiones reutilizables."""
+    with _lock:
+        session = _sessions.get(origin)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[origin] = session
+        return session
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_sessions(**kwargs):
+    """
+    Cierra las conexiones abiertas. Se ejecuta al apagar cada proceso del worker de
+    Celery (prefork) y el worker mismo (pools solo/threads).
+    """
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()